@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+使用仓库自带的 xiaoshani/img 模板、0.txt 段落文件和 fonts/simkai.ttf，测量：
+1. 单张渲染（描边宽度 0/2/4）和多行段落渲染的每秒张数与每张耗时分位数
+2. batch_process_images 和 auto_process_images（固定随机种子）的整体吞吐量
+3. 各输出格式（JPEG/PNG/WebP/AVIF）的编码耗时和每张图片的字节数（当前Pillow不支持的格式跳过）
+结果保存为JSON，并可以与保存的基线比较，超过阈值的变慢视为性能回退
+
+用法:
+    python benchmark.py                                  # 运行并输出到 benchmark_results.json
+    python benchmark.py --save-baseline                  # 运行并保存为基线
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.1
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+
+import PIL
+from PIL import Image
+
+from imgaddtext import ImageTextAdder, OUTPUT_FORMATS
+from stage_timer import percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_IMG_DIR = os.path.join(BASE_DIR, "xiaoshani", "img")
+DEFAULT_TEXT_FILE = os.path.join(BASE_DIR, "xiaoshani", "20250918", "0.txt")
+DEFAULT_FONT = "simkai"
+DEFAULT_RESULTS = "benchmark_results.json"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# 固定随机种子，保证每次自动处理选中的模板相同
+BENCHMARK_SEED = 20250918
+
+# 单行文字用例使用的文字
+SINGLE_LINE_TEXT = "愿孩子勤学上进"
+
+
+def summarize(durations, total_seconds=None):
+    """根据每张耗时（秒）汇总吞吐量和耗时分位数"""
+    durations = sorted(durations)
+    total = total_seconds if total_seconds is not None else sum(durations)
+    result = {
+        'images': len(durations),
+        'seconds': round(total, 4),
+        'images_per_sec': round(len(durations) / total, 3) if total > 0 else 0.0,
+    }
+    if durations:
+        result['latency_ms'] = {
+            'mean': round(sum(durations) / len(durations) * 1000, 3),
+            'p50': round(percentile(durations, 0.50) * 1000, 3),
+            'p90': round(percentile(durations, 0.90) * 1000, 3),
+            'p95': round(percentile(durations, 0.95) * 1000, 3),
+            'p99': round(percentile(durations, 0.99) * 1000, 3),
+            'max': round(durations[-1] * 1000, 3),
+        }
+    return result
+
+
+class Benchmark:
+    def __init__(self, img_dir=DEFAULT_IMG_DIR, text_file=DEFAULT_TEXT_FILE,
+                 font_name=DEFAULT_FONT, images=20, repeat=1):
+        """
+        参数:
+        - img_dir: 模板图片文件夹
+        - text_file: 段落文件（0.txt）
+        - font_name: 字体名称
+        - images: 每个用例渲染的模板数量
+        - repeat: 每个用例重复的次数
+        """
+        self.img_dir = img_dir
+        self.text_file = text_file
+        self.font_name = font_name
+        self.images = images
+        self.repeat = repeat
+        self.adder = ImageTextAdder(verbose=False)
+        self.templates = [entry['path'] for entry in self.adder.get_template_index(img_dir).refresh()]
+        self.paragraphs = self._quiet(self.adder.parse_text_paragraphs, text_file)
+        if not self.templates:
+            raise ValueError(f"模板文件夹中没有图片: {img_dir}")
+        if not self.paragraphs:
+            raise ValueError(f"段落文件中没有段落: {text_file}")
+        self.work_dir = tempfile.mkdtemp(prefix="imgaddtext_bench_")
+        self._rendered = None
+
+    def _quiet(self, func, *args, **kwargs):
+        """调用时丢弃标准输出，避免终端输出影响计时"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+
+    def _sample_templates(self):
+        """按文件名均匀抽取模板，覆盖不同尺寸和位置"""
+        step = max(1, len(self.templates) // self.images)
+        return self.templates[::step][:self.images]
+
+    def _time_renders(self, jobs):
+        """逐张调用 add_text_to_image 并记录耗时，jobs 为 (模板, 文字, 参数) 列表"""
+        output_dir = os.path.join(self.work_dir, "single")
+        os.makedirs(output_dir, exist_ok=True)
+
+        # 预热：字体加载等一次性开销不计入
+        template, text, options = jobs[0]
+        self.adder.add_text_to_image(template, text, os.path.join(output_dir, "warmup.jpg"),
+                                     font_name=self.font_name, **options)
+
+        durations = []
+        for _ in range(self.repeat):
+            for i, (template, text, options) in enumerate(jobs):
+                output_path = os.path.join(output_dir, f"{i}.jpg")
+                start = time.perf_counter()
+                result = self.adder.add_text_to_image(template, text, output_path,
+                                                      font_name=self.font_name, **options)
+                durations.append(time.perf_counter() - start)
+                if result is None:
+                    raise RuntimeError(f"渲染失败: {template}: {self.adder.last_error}")
+        return summarize(durations)
+
+    def bench_single(self, outline_width):
+        """单行文字，指定描边宽度"""
+        options = {'color': 'white', 'outline_width': outline_width,
+                   'outline_color': 'black' if outline_width else None}
+        return self._time_renders([(template, SINGLE_LINE_TEXT, options)
+                                   for template in self._sample_templates()])
+
+    def bench_multiline(self):
+        """0.txt 中的多行段落，带描边"""
+        options = {'color': 'white', 'outline_color': 'black', 'outline_width': 2}
+        templates = self._sample_templates()
+        return self._time_renders([(template, self.paragraphs[i % len(self.paragraphs)], options)
+                                   for i, template in enumerate(templates)])
+
+    def bench_batch(self):
+        """batch_process_images：模板和段落文件复制到临时文件夹中处理"""
+        batch_dir = os.path.join(self.work_dir, "batch")
+        os.makedirs(batch_dir, exist_ok=True)
+        templates = self._sample_templates()
+        for template in templates:
+            shutil.copy(template, batch_dir)
+        text_file = os.path.join(self.work_dir, "batch.txt")
+        with open(text_file, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(self.paragraphs[i % len(self.paragraphs)] for i in range(len(templates))))
+
+        durations = []
+        total = 0.0
+        count = 0
+        for run in range(self.repeat):
+            output_dir = os.path.join(self.work_dir, f"batch_output_{run}")
+            start = time.perf_counter()
+            count += self._quiet(self.adder.batch_process_images, batch_dir, text_file, output_dir,
+                                 font_name=self.font_name)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            durations.append(elapsed)
+        result = summarize([], total)
+        result['images'] = count
+        result['images_per_sec'] = round(count / total, 3) if total > 0 else 0.0
+        result['runs_ms'] = [round(d * 1000, 3) for d in durations]
+        return result
+
+    def bench_auto(self):
+        """auto_process_images：固定随机种子，从全部模板中选择"""
+        auto_dir = os.path.join(self.work_dir, "auto")
+        os.makedirs(auto_dir, exist_ok=True)
+        shutil.copy(self.text_file, os.path.join(auto_dir, "0.txt"))
+
+        durations = []
+        total = 0.0
+        count = 0
+        for run in range(self.repeat):
+            random.seed(BENCHMARK_SEED)
+            output_dir = os.path.join(self.work_dir, f"auto_output_{run}")
+            start = time.perf_counter()
+            count += self._quiet(self.adder.auto_process_images, auto_dir, self.img_dir, output_dir,
+                                 font_name=self.font_name)
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            durations.append(elapsed)
+        result = summarize([], total)
+        result['images'] = count
+        result['images_per_sec'] = round(count / total, 3) if total > 0 else 0.0
+        result['runs_ms'] = [round(d * 1000, 3) for d in durations]
+        return result
+
+    def _rendered_images(self):
+        """渲染好的图片（只渲染一次，各编码用例共用）"""
+        if self._rendered is None:
+            self._rendered = [
+                self.adder._render(template, SINGLE_LINE_TEXT, self.font_name, 40, 'white', None,
+                                   'black', 2, 'fast', log=False)
+                for template in self._sample_templates()
+            ]
+        return self._rendered
+
+    def bench_encode(self, output_format):
+        """只计时编码：把渲染好的图片按指定格式（默认编码参数）写入内存"""
+        image_format = OUTPUT_FORMATS[output_format][0]
+        images = self._rendered_images()
+        self.adder._save_image(images[0], io.BytesIO(), image_format=image_format)  # 预热
+
+        durations = []
+        total_bytes = 0
+        for _ in range(self.repeat):
+            for image in images:
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                self.adder._save_image(image, buffer, image_format=image_format)
+                durations.append(time.perf_counter() - start)
+                total_bytes += buffer.tell()
+        result = summarize(durations)
+        result['bytes_per_image'] = total_bytes // len(durations)
+        return result
+
+    def run(self, cases=None):
+        """运行全部（或指定的）用例，返回结果字典"""
+        all_cases = {
+            'single_outline0': lambda: self.bench_single(0),
+            'single_outline2': lambda: self.bench_single(2),
+            'single_outline4': lambda: self.bench_single(4),
+            'multiline': self.bench_multiline,
+            'batch': self.bench_batch,
+            'auto': self.bench_auto,
+        }
+        Image.init()
+        for output_format, (image_format, _) in OUTPUT_FORMATS.items():
+            if image_format in Image.SAVE:
+                all_cases[f'encode_{output_format}'] = (lambda fmt=output_format: self.bench_encode(fmt))
+        results = {}
+        try:
+            for name, func in all_cases.items():
+                if cases and name not in cases:
+                    continue
+                print(f"⏱️  {name} ...", end=" ", flush=True)
+                results[name] = func()
+                size = results[name].get('bytes_per_image')
+                print(f"{results[name]['images_per_sec']} 张/秒"
+                      + (f"，{size / 1024:.1f} KB/张" if size is not None else ""))
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+        return {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'font': self.font_name,
+                'font_path': self.adder._resolve_font_path(self.font_name),
+                'images': self.images,
+                'repeat': self.repeat,
+                'seed': BENCHMARK_SEED,
+            },
+            'cases': results,
+        }
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线比较，返回回退的用例列表
+
+    每秒张数低于基线 (1 - threshold) 倍，或 p95 耗时高于基线 (1 + threshold) 倍时视为回退
+    """
+    regressions = []
+    print(f"\n📊 与基线比较（阈值 {threshold:.0%}）:")
+    print(f"{'用例':<18}{'基线 张/秒':>12}{'当前 张/秒':>12}{'变化':>10}")
+    for name, current in results['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if not base:
+            print(f"{name:<18}{'-':>12}{current['images_per_sec']:>12}{'新增':>10}")
+            continue
+        base_rate = base['images_per_sec']
+        rate = current['images_per_sec']
+        change = (rate - base_rate) / base_rate if base_rate else 0.0
+        regressed = base_rate and rate < base_rate * (1 - threshold)
+
+        base_p95 = base.get('latency_ms', {}).get('p95')
+        p95 = current.get('latency_ms', {}).get('p95')
+        if base_p95 and p95 and p95 > base_p95 * (1 + threshold):
+            regressed = True
+
+        mark = "❌" if regressed else "✅"
+        print(f"{name:<18}{base_rate:>12}{rate:>12}{change:>+10.1%} {mark}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="imgaddtext 性能基准测试")
+    parser.add_argument("--img-dir", default=DEFAULT_IMG_DIR, help="模板图片文件夹")
+    parser.add_argument("--text-file", default=DEFAULT_TEXT_FILE, help="段落文件（0.txt）")
+    parser.add_argument("-f", "--font", default=DEFAULT_FONT, help="字体名称")
+    parser.add_argument("-n", "--images", type=int, default=20, help="每个用例渲染的模板数量")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="每个用例重复的次数")
+    parser.add_argument("--case", action="append", help="只运行指定用例（可重复指定）")
+    parser.add_argument("-o", "--output", default=DEFAULT_RESULTS, help="结果输出文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回退阈值（比例），默认0.10")
+    args = parser.parse_args()
+
+    # 字体从当前目录下的 fonts 文件夹查找，切换到仓库目录，保证使用自带的字体
+    for name in ('img_dir', 'text_file', 'output', 'baseline'):
+        setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(BASE_DIR)
+
+    benchmark = Benchmark(args.img_dir, args.text_file, args.font, args.images, args.repeat)
+    results = benchmark.run(args.case)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 结果已保存: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 基线已保存: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️  基线文件不存在: {args.baseline}，使用 --save-baseline 创建")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ 性能回退: {', '.join(regressions)}")
+        return 1
+    print("\n✅ 没有发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结构化事件日志
+功能：
+1. 批量/自动处理时每张图片写一条JSON记录（JSON Lines格式），供任务调度程序读取
+2. 记录先放在内存缓冲区，达到条数或时间间隔后一次性写入，不在每张图片后同步写文件
+"""
+
+import json
+import time
+import threading
+
+# 缓冲区达到这么多条记录时写入文件
+EVENT_BUFFER_SIZE = 100
+
+# 距离上次写入超过这么多秒时写入文件
+EVENT_FLUSH_INTERVAL = 1.0
+
+
+class EventLog:
+    def __init__(self, path, buffer_size=EVENT_BUFFER_SIZE, flush_interval=EVENT_FLUSH_INTERVAL):
+        """
+        参数:
+        - path: 输出文件路径（追加写入）
+        - buffer_size: 缓冲的最大记录数
+        - flush_interval: 最长写入间隔（秒）
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, event, **fields):
+        """记录一个事件，event 为事件类型，其它字段原样写入"""
+        record = {'event': event, 'ts': round(time.time(), 3)}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if (len(self._buffer) >= self.buffer_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self):
+        """把缓冲区中的记录写入文件"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer and not self._file.closed:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._file.flush()
+            self._buffer.clear()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """写入剩余记录并关闭文件"""
+        with self._lock:
+            self._flush_locked()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
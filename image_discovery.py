@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片文件查找
+功能：
+1. 用一次 os.scandir 遍历列出文件夹中的图片，扩展名不区分大小写
+2. 可以递归查找子文件夹，每个结果附带遍历时得到的文件信息（大小、修改时间），不再单独 stat
+3. 排序键在查找时计算一次：默认按自然顺序（2.jpg 排在 10.jpg 前面）
+"""
+
+import os
+import re
+from collections import namedtuple
+
+# 支持的图片扩展名（不区分大小写）
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+
+_NUMBER_PATTERN = re.compile(r'(\d+)')
+
+# path: 完整路径，name: 文件名，relpath: 相对查找根目录的路径，stat: os.stat_result（未请求时为None）
+ImageFile = namedtuple('ImageFile', ('path', 'name', 'relpath', 'stat', 'sort_key'))
+
+
+def has_image_extension(name, extensions=IMAGE_EXTENSIONS):
+    """文件名是否为图片扩展名（不区分大小写）"""
+    return name.lower().endswith(tuple(extensions))
+
+
+def natural_sort_key(name):
+    """自然排序键：文件名中的数字按数值比较，其它部分不区分大小写"""
+    parts = _NUMBER_PATTERN.split(name.lower())
+    # split 的结果中奇数位置是数字，所以两个键同一位置的类型总是相同；完全相同时按原文件名
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(parts)), name
+
+
+def leading_number_key(name):
+    """按文件名第一个 - 之前部分的第一个数值排序（没有数字时为0），数值相同时按文件名"""
+    match = _NUMBER_PATTERN.search(name.split('-', 1)[0])
+    return (int(match.group()) if match else 0, name)
+
+
+def discover_images(folder, extensions=IMAGE_EXTENSIONS, recursive=False, with_stat=False,
+                    sort_key=natural_sort_key, skip_hidden=True):
+    """
+    查找文件夹中的图片文件，返回按 sort_key 排序的 ImageFile 列表
+
+    参数:
+    - folder: 查找的文件夹
+    - extensions: 图片扩展名（小写，带点）
+    - recursive: 递归查找子文件夹
+    - with_stat: 附带文件信息（Windows 上直接来自目录遍历，不额外访问文件）
+    - sort_key: 排序键函数，参数为相对路径；为None时不排序
+    - skip_hidden: 递归时跳过以 . 开头的文件夹
+
+    文件夹不存在或无法读取时返回空列表
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    results = []
+    pending = [(folder, '')]
+    while pending:
+        current, prefix = pending.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    name = entry.name
+                    # 不跟随指向文件夹的符号链接，避免循环
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        if not (skip_hidden and name.startswith('.')):
+                            pending.append((entry.path, prefix + name + os.sep))
+                        continue
+                    if not name.lower().endswith(extensions) or not entry.is_file():
+                        continue
+                    relpath = prefix + name
+                    results.append(ImageFile(
+                        entry.path, name, relpath,
+                        entry.stat() if with_stat else None,
+                        sort_key(relpath) if sort_key else None,
+                    ))
+        except OSError:
+            continue
+    if sort_key:
+        results.sort(key=lambda image: image.sort_key)
+    return results
+
+
+def list_images(folder, extensions=IMAGE_EXTENSIONS, recursive=False, sort_key=natural_sort_key):
+    """查找文件夹中的图片文件，返回排好序的完整路径列表"""
+    return [image.path for image in discover_images(folder, extensions, recursive, sort_key=sort_key)]
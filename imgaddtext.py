@@ -10,25 +10,371 @@
 """
 
 import os
+import io
 import sys
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 import argparse
 from pathlib import Path
-import glob
-import re
 import random
+import threading
+import queue
+import time
+import json
+import hashlib
+import math
+import itertools
+import cProfile
+import pstats
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from render_cache import RenderCache, DEFAULT_CACHE_SIZE_MB
+from template_index import TemplateIndex, compute_text_area
+from image_discovery import leading_number_key
+from content_aware import find_calm_position, pick_text_colors
+from template_cache import TemplateCache, PixelCache
+from stage_timer import StageTimer
+from event_log import EventLog
+from text_layout import TextMeasurer, layout_text, DEFAULT_MIN_FONT_SIZE, LINE_SPACING
+
+
+# 文字渲染模式：fast 每行只光栅化一次得到蒙版，加粗、描边和填充都由蒙版派生；
+# legacy 保留原来的多次偏移重绘方式，用于需要逐像素兼容旧输出的场景
+RENDER_MODES = ('fast', 'legacy')
+
+# JPEG编码预设：在编码耗时和文件大小之间取舍
+# fast 与Pillow默认参数一致（也是旧版本的输出参数）
+JPEG_PRESETS = {
+    'fast': {'quality': 75, 'subsampling': '4:2:0', 'optimize': False, 'progressive': False},
+    'balanced': {'quality': 85, 'subsampling': '4:2:0', 'optimize': True, 'progressive': False},
+    'small': {'quality': 70, 'subsampling': '4:2:0', 'optimize': True, 'progressive': True},
+}
+# 批量输出格式：名称 -> (Pillow格式, 扩展名)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'avif': ('AVIF', '.avif'),
+}
+
+# 各格式 quality（质量）和 effort（压缩力度，越大文件越小、编码越慢）的取值范围，
+# 未指定时使用Pillow的默认值
+#   JPEG: quality 覆盖编码预设中的质量，压缩力度由编码预设决定
+#   PNG:  effort 为 zlib 压缩级别，9 时同时启用 optimize
+#   WEBP: effort 为 method
+#   AVIF: effort 为 10 - speed，encode_threads 为编码线程数（默认使用全部CPU核心）
+ENCODER_RANGES = {
+    'JPEG': {'quality': (1, 100)},
+    'PNG': {'effort': (0, 9)},
+    'WEBP': {'quality': (0, 100), 'effort': (0, 6)},
+    'AVIF': {'quality': (0, 100), 'effort': (0, 10)},
+}
+
+# 编码参数，批量处理时只在指定时放入渲染参数
+ENCODE_OPTIONS = ('quality', 'effort', 'encode_threads')
+
+# --color auto 需要描边而没有指定描边宽度时，描边宽度为字号除以这个值
+AUTO_OUTLINE_RATIO = 25
+
+# 流水线模式下各阶段之间队列的容量（最多预取/积压的图片数）
+PIPELINE_QUEUE_SIZE = 4
+
+# 渲染服务模式下没有指定 --template-cache-mb 时的模板缓存大小（MB）
+SERVE_TEMPLATE_CACHE_MB = 512
+
+# --cprofile 时在终端显示的函数数量
+PROFILE_TOP_FUNCTIONS = 15
+
+# 只影响处理方式、不影响输出图片的参数，判断 --auto-all 的输出是否最新时忽略
+AUTO_STAMP_IGNORED_OPTIONS = ('jobs', 'pipeline', 'incremental', 'render_cache_dir', 'render_cache_size_mb',
+                              'encode_threads')
+
+
+class FontCache:
+    """已加载字体对象的LRU缓存，按 (字体路径, 字体大小) 索引，线程安全"""
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """命中时直接返回缓存的字体，否则调用 loader 加载并放入缓存"""
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+
+            # 在锁内加载，避免多个线程重复解析同一个字体文件
+            font = loader()
+            self.misses += 1
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_size:
+                self._fonts.popitem(last=False)
+            return font
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._fonts.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._fonts),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+class RenderPipeline:
+    """
+    解码 → 渲染 → 编码 三段流水线
+    
+    每个阶段一个线程，阶段之间用有界队列连接：预取线程提前解码后面的模板，
+    渲染线程绘制文字，写入线程编码并保存，使磁盘读写和绘制可以同时进行。
+    各阶段按任务顺序处理，结果也按任务顺序产出。
+    """
+    
+    STAGES = ('decode', 'render', 'encode')
+    STAGE_NAMES = {'decode': '解码', 'render': '渲染', 'encode': '编码'}
+    
+    def __init__(self, adder, render_options, queue_size=PIPELINE_QUEUE_SIZE):
+        self.adder = adder
+        self.render_options = render_options
+        self.queue_size = queue_size
+        self.busy_time = {stage: 0.0 for stage in self.STAGES}
+        self.wall_time = 0.0
+        self._stop = threading.Event()
+    
+    def run(self, tasks):
+        """
+        处理 (图片路径, 文本, 输出路径, 布局提示) 任务列表
+        
+        按顺序逐个产出 (输出路径或None, 错误信息, 三个阶段处理这张图片的总耗时（秒）, 超出可用区域信息)
+        """
+        decode_queue = queue.Queue(self.queue_size)
+        encode_queue = queue.Queue(self.queue_size)
+        done_queue = queue.Queue()
+        threads = [
+            threading.Thread(target=self._decode_stage, args=(tasks, decode_queue), daemon=True),
+            threading.Thread(target=self._render_stage, args=(decode_queue, encode_queue), daemon=True),
+            threading.Thread(target=self._encode_stage, args=(encode_queue, done_queue), daemon=True),
+        ]
+        
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in tasks:
+                yield done_queue.get()
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall_time = time.perf_counter() - start
+    
+    def utilization(self):
+        """各阶段忙碌时间占总耗时的比例"""
+        if self.wall_time <= 0:
+            return {stage: 0.0 for stage in self.STAGES}
+        return {stage: self.busy_time[stage] / self.wall_time for stage in self.STAGES}
+    
+    def print_stats(self):
+        """打印各阶段利用率，利用率最高的阶段就是瓶颈"""
+        utilization = self.utilization()
+        bottleneck = max(utilization, key=utilization.get)
+        summary = " | ".join(f"{self.STAGE_NAMES[stage]} {utilization[stage]:.0%}"
+                             for stage in self.STAGES)
+        print(f"⏱️  流水线阶段利用率: {summary}（瓶颈: {self.STAGE_NAMES[bottleneck]}）")
+    
+    def _put(self, target_queue, item):
+        """放入有界队列，下游已停止时放弃"""
+        while not self._stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, source_queue):
+        """从队列取出任务，下游已停止时返回None"""
+        while not self._stop.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+    
+    def _decode_stage(self, tasks, decode_queue):
+        render_mode = self.render_options.get('render_mode', 'fast')
+        for image_path, text_content, output_path, layout_hint in tasks:
+            start = time.perf_counter()
+            image, error = None, None
+            try:
+                image = self.adder._open_image(image_path, render_mode)
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - start
+            self.busy_time['decode'] += elapsed
+            if not self._put(decode_queue, (image_path, text_content, output_path, layout_hint,
+                                            image, error, elapsed)):
+                return
+    
+    def _render_stage(self, decode_queue, encode_queue):
+        options = self.render_options
+        while True:
+            item = self._get(decode_queue)
+            if item is None:
+                return
+            image_path, text_content, output_path, layout_hint, image, error, elapsed = item
+            
+            start = time.perf_counter()
+            overflow = None
+            if error is None:
+                try:
+                    position, font_size = self.adder._resolve_layout(
+                        image_path, None, options['font_size'], log=False, layout_hint=layout_hint,
+                        default_position=options.get('default_position', 'top-left')
+                    )
+                    image = self.adder._draw_text(
+                        image, text_content, options['font_name'], font_size,
+                        options['color'], position, options['outline_color'],
+                        options['outline_width'], options.get('render_mode', 'fast'), image_path,
+                        wrap=options.get('wrap', False), fit=options.get('fit', False),
+                        min_font_size=options.get('min_font_size', DEFAULT_MIN_FONT_SIZE), log=False
+                    )
+                    # 只有渲染线程调用 _draw_text，这里读取 last_overflow 不会被其它图片覆盖
+                    overflow = self.adder.last_overflow
+                except Exception as e:
+                    image, error = None, str(e)
+            seconds = time.perf_counter() - start
+            self.busy_time['render'] += seconds
+            if not self._put(encode_queue, (output_path, image, error, elapsed + seconds, overflow)):
+                return
+    
+    def _encode_stage(self, encode_queue, done_queue):
+        jpeg_preset = self.render_options.get('jpeg_preset', 'fast')
+        encode_options = {key: self.render_options[key] for key in ENCODE_OPTIONS
+                          if key in self.render_options}
+        while True:
+            item = self._get(encode_queue)
+            if item is None:
+                return
+            output_path, image, error, elapsed, overflow = item
+            
+            start = time.perf_counter()
+            if error is None:
+                try:
+                    self.adder._save_image(image, output_path, jpeg_preset, **encode_options)
+                except Exception as e:
+                    error = str(e)
+            seconds = time.perf_counter() - start
+            self.busy_time['encode'] += seconds
+            done_queue.put((output_path if error is None else None, error, elapsed + seconds, overflow))
+
 
 class ImageTextAdder:
-    def __init__(self):
+    def __init__(self, font_cache_size=32, verbose=True, template_cache_mb=0,
+                 pixel_cache_dir=None, profile=False):
         self.fonts_dir = Path("fonts")
-        self.available_fonts = self._get_available_fonts()
+        self.verbose = verbose
+        self.last_error = None
+        # 最近一次绘制的文字块超出可用区域时为 (文字宽, 文字高, 可用宽, 可用高)，否则为None
+        self.last_overflow = None
+        # 最近一次自动处理应当生成的图片数量
+        self.last_expected_count = 0
+        self.font_cache = FontCache(font_cache_size)
+        # 文字测量缓存，按 (字体, 字号, 文字) 记住边界框
+        self.measurer = TextMeasurer()
+        # 已解码模板图片的内存缓存，0表示不缓存
+        self.template_cache = None
+        if template_cache_mb > 0:
+            self.template_cache = TemplateCache(int(template_cache_mb * 1024 * 1024))
+        # 磁盘上的解码像素缓存，多次运行和多个工作进程之间共享缓存文件（读取时各自复制一份像素）
+        self.pixel_cache = PixelCache(pixel_cache_dir) if pixel_cache_dir else None
+        # 分阶段计时，默认关闭
+        self.timer = StageTimer(profile)
+        # 结构化事件日志（EventLog），批量处理时每张图片写一条记录
+        self.events = None
+        self._font_paths = {}
+        self._template_indexes = {}
+        # 进程池；keep_render_pool=True 时多次批量处理之间复用，不重复启动工作进程
+        self.keep_render_pool = False
+        self._render_pool = None
+        self._render_pool_jobs = None
+        # 渲染服务的每个请求在各自的线程中调用 submit_render_to_bytes，创建和关闭进程池时需要加锁
+        self._render_pool_lock = threading.RLock()
+        self.font_registry_path = self.fonts_dir / ".font_registry.json"
+        # 字体列表在第一次访问 available_fonts 时才探测
+        self._available_fonts = None
+
+    @property
+    def available_fonts(self):
+        """可用字体列表（延迟探测，优先读取字体注册表）"""
+        if self._available_fonts is None:
+            self._available_fonts = self._get_available_fonts()
+        return self._available_fonts
+
+    def refresh_fonts(self):
+        """忽略字体注册表，重新探测可用字体"""
+        self._available_fonts = self._get_available_fonts(refresh=True)
+        return self._available_fonts
+
+    def _log(self, message):
+        """输出处理过程中的提示信息（verbose=False 时不输出）"""
+        if self.verbose:
+            print(message)
+    
+    def _log_error(self, message):
+        """输出单张图片的错误信息；写事件日志时错误只记录在事件中"""
+        if self.events is None:
+            print(message)
+    
+    @staticmethod
+    def overflow_message(overflow):
+        """文字块超出可用区域的提示，overflow 为 last_overflow 的值"""
+        text_width, text_height, area_width, area_height = overflow
+        return (f"⚠️  文字超出可用区域: 文字 {text_width}x{text_height}，"
+                f"可用 {area_width}x{area_height}（可以使用 --wrap 或 --fit）")
+
+    @property
+    def font_cache_hits(self):
+        """字体缓存命中次数"""
+        return self.font_cache.hits
+
+    @property
+    def font_cache_misses(self):
+        """字体缓存未命中次数（即实际解析字体文件的次数）"""
+        return self.font_cache.misses
         
-    def _get_available_fonts(self):
+    def _get_available_fonts(self, refresh=False):
         """获取可用的字体列表"""
-        fonts = {}
-        
         # 创建fonts目录如果不存在
         self.fonts_dir.mkdir(exist_ok=True)
+
+        if not refresh:
+            fonts = self._load_font_registry()
+            if fonts is not None:
+                return fonts
+
+        entries = self._probe_fonts()
+        self._save_font_registry(entries)
+        return {font_key: entry['name'] for font_key, entry in entries.items()}
+
+    def _probe_fonts(self):
+        """实际探测字体，返回 {字体键: {name, path, mtime}}"""
+        fonts = {}
         
         # 优先尝试中文字体
         chinese_fonts = [
@@ -51,7 +397,7 @@ class ImageTextAdder:
         for font_key, font_name in chinese_fonts:
             try:
                 font = ImageFont.truetype(font_key, 40)
-                fonts[font_key] = font_name
+                fonts[font_key] = self._font_registry_entry(font_name, font.path)
             except:
                 continue
         
@@ -70,7 +416,7 @@ class ImageTextAdder:
         for font_key, font_name in system_fonts:
             try:
                 font = ImageFont.truetype(font_key, 40)
-                fonts[font_key] = font_name
+                fonts[font_key] = self._font_registry_entry(font_name, font.path)
             except:
                 continue
                 
@@ -79,12 +425,68 @@ class ImageTextAdder:
         for font_file in font_files:
             try:
                 font_key = font_file.stem
-                fonts[font_key] = font_key
+                fonts[font_key] = self._font_registry_entry(font_key, str(font_file))
             except:
                 continue
                 
         return fonts
     
+    def _font_registry_entry(self, font_name, font_path):
+        """生成字体注册表条目，记录字体文件路径和修改时间"""
+        font_path = os.path.abspath(font_path) if os.path.exists(font_path) else font_path
+        try:
+            mtime = os.stat(font_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        return {'name': font_name, 'path': font_path, 'mtime': mtime}
+
+    def _fonts_dir_mtime(self):
+        try:
+            return os.stat(self.fonts_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_font_registry(self):
+        """读取字体注册表，fonts目录或任一字体文件有变化时返回None"""
+        try:
+            with open(self.font_registry_path, 'r', encoding='utf-8') as f:
+                registry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if registry.get('fonts_dir_mtime') != self._fonts_dir_mtime():
+            return None
+
+        fonts = {}
+        for font_key, entry in registry.get('fonts', {}).items():
+            if entry.get('mtime') is not None:
+                try:
+                    if os.stat(entry['path']).st_mtime_ns != entry['mtime']:
+                        return None
+                except OSError:
+                    return None
+            fonts[font_key] = entry['name']
+        return fonts
+
+    def _save_font_registry(self, entries):
+        """保存字体注册表，写入失败时忽略（例如只读目录）"""
+        try:
+            # 先确保注册表文件存在：创建文件会改变fonts目录的修改时间，
+            # 而原地改写已有文件不会，这样记录下来的目录时间才有效
+            self.font_registry_path.touch(exist_ok=True)
+            registry = {
+                'fonts_dir_mtime': self._fonts_dir_mtime(),
+                'fonts': entries,
+            }
+            with open(self.font_registry_path, 'w', encoding='utf-8') as f:
+                json.dump(registry, f, ensure_ascii=False, indent=2)
+        except OSError:
+            pass
+    
+    def is_auto_color(self, color_input):
+        """颜色是否为 auto（按背景亮度自动选择）"""
+        return isinstance(color_input, str) and color_input.strip().lower() == 'auto'
+    
     def parse_color(self, color_input):
         """解析颜色输入，支持多种格式"""
         if isinstance(color_input, str):
@@ -134,26 +536,41 @@ class ImageTextAdder:
         # 默认返回黑色
         return (0, 0, 0)
     
-    def get_font(self, font_name, font_size):
-        """获取字体对象"""
+    def _resolve_font_path(self, font_name):
+        """解析字体名称对应的字体文件路径，结果会被记住"""
+        font_path = self._font_paths.get(font_name)
+        if font_path is not None:
+            return font_path
+
+        # 优先使用fonts目录中的字体文件，否则交给系统字体查找
+        font_path = font_name
+        for ext in ('.ttf', '.otf'):
+            candidate = self.fonts_dir / f"{font_name}{ext}"
+            if candidate.exists():
+                font_path = str(candidate.resolve())
+                break
+
+        self._font_paths[font_name] = font_path
+        return font_path
+
+    def _load_font(self, font_path, font_size):
+        """从磁盘加载字体，失败时依次回退到arial和默认字体"""
         try:
-            # 尝试从fonts目录加载
-            font_path = self.fonts_dir / f"{font_name}.ttf"
-            if font_path.exists():
-                return ImageFont.truetype(str(font_path), font_size)
-            
-            font_path = self.fonts_dir / f"{font_name}.otf"
-            if font_path.exists():
-                return ImageFont.truetype(str(font_path), font_size)
-            
-            # 尝试系统字体
-            return ImageFont.truetype(font_name, font_size)
+            return ImageFont.truetype(font_path, font_size)
         except:
             # 使用默认字体
             try:
                 return ImageFont.truetype("arial.ttf", font_size)
             except:
                 return ImageFont.load_default()
+
+    def get_font(self, font_name, font_size):
+        """获取字体对象（带缓存，同一字体和大小只解析一次）"""
+        font_path = self._resolve_font_path(font_name)
+        return self.font_cache.get(
+            (font_path, font_size),
+            lambda: self._load_font(font_path, font_size)
+        )
     
     def parse_position_and_size_from_filename(self, image_path):
         """从图片文件名解析位置和字体大小信息"""
@@ -276,7 +693,10 @@ class ImageTextAdder:
     def add_text_to_image(self, image_path, text, output_path=None, 
                          font_name="arial", font_size=40, 
                          color="black", position=None, 
-                         outline_color=None, outline_width=0):
+                         outline_color=None, outline_width=0,
+                         render_mode="fast", jpeg_preset="fast", layout_hint=None,
+                         wrap=False, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE,
+                         default_position="top-left", quality=None, effort=None, encode_threads=None):
         """
         给图片添加文字
         
@@ -290,143 +710,575 @@ class ImageTextAdder:
         - position: 文字位置
         - outline_color: 描边颜色（可选）
         - outline_width: 描边宽度
+        - render_mode: 渲染模式，fast（蒙版渲染）或 legacy（多次重绘）
+        - jpeg_preset: JPEG编码预设，fast、balanced 或 small
+        - layout_hint: 已解析好的 (位置, 字体大小)，例如来自模板索引，
+          提供时不再从文件名解析
+        - wrap: 按可用宽度自动换行（可用宽度由位置决定：从文字起点到图片右边缘）
+        - fit: 文字块放不下时自动缩小字号（同时启用自动换行）
+        - min_font_size: 自动缩小字号时的最小字号
+        - default_position: 没有指定位置、文件名中也没有位置信息时使用的位置，
+          auto 表示自动选择画面最平坦的区域
+        - quality: 编码质量（JPEG、WEBP、AVIF），默认使用编码器的默认值
+        - effort: 压缩力度（PNG、WEBP、AVIF），越大文件越小、编码越慢
+        - encode_threads: 编码线程数（只有AVIF支持）
+        
+        输出格式由 output_path 的扩展名决定（.jpg、.png、.webp、.avif 等）
         """
         
+        self.last_error = None
+        self.last_overflow = None
         try:
-            # 尝试从文件名解析位置和字体大小
-            parsed_position, parsed_font_size = self.parse_position_and_size_from_filename(image_path)
-            
-            # 处理位置解析
-            if position is None:
-                if parsed_position:
-                    x_part, y_part = parsed_position
-                    position = f"{x_part},{y_part}"
-                    print(f"📋 从文件名解析位置: {position}")
-                else:
-                    position = "top-left"
-                    print(f"📋 使用默认位置: {position}")
-            
-            # 处理字体大小解析
-            if parsed_font_size is not None:
-                font_size = parsed_font_size
-                print(f"📋 从文件名解析字体大小: {font_size}")
-            
-            # 打开图片
-            image = Image.open(image_path)
-            if image.mode != 'RGBA':
-                image = image.convert('RGBA')
-            
-            # 创建透明图层用于文字
-            text_layer = Image.new('RGBA', image.size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(text_layer)
-            
-            # 获取字体
-            font = self.get_font(font_name, font_size)
-            
-            # 解析颜色
-            text_color = self.parse_color(color)
-            outline_color_parsed = None
-            if outline_color:
-                outline_color_parsed = self.parse_color(outline_color)
-            
-            # 获取文字尺寸（处理多行文字）
-            lines = text.split('\n')
-            line_height = font_size + 5  # 使用参数中的字体大小 + 行间距
-            
-            # 计算最大行宽度
-            max_width = 0
-            for line in lines:
-                if line.strip():  # 只计算非空行
-                    bbox = draw.textbbox((0, 0), line, font=font)
-                    line_width = bbox[2] - bbox[0]
-                    max_width = max(max_width, line_width)
-            
-            text_width = max_width
-            text_height = len([line for line in lines if line.strip()]) * line_height
-            
-            # 解析位置
-            pos = self.parse_position(position, image.size, (text_width, text_height), image_path)
-            
-            # 按照正确思路计算多行文字位置：
-            # 1. 先算行数
-            non_empty_lines = [line for line in lines if line.strip()]
-            line_count = len(non_empty_lines)
-            
-            # 2. 根据字体大小算整个文字区域的高度
-            total_height = line_count * line_height
-            
-            # 3. 基于解析出的位置计算起始位置
-            # pos[1] 是解析出的Y坐标，这应该是文字区域top距离图片顶部的距离
-            start_y = pos[1]
-            
-            # 绘制描边（如果有）- 支持多行文字
-            if outline_color_parsed and outline_width > 0:
-                line_index = 0
-                for line in lines:
-                    if not line.strip():  # 跳过空行
-                        continue
-                        
-                    line_y = start_y + line_index * line_height
-                    line_pos = (pos[0], line_y)
-                    
-                    for dx in range(-outline_width, outline_width + 1):
-                        for dy in range(-outline_width, outline_width + 1):
-                            if dx != 0 or dy != 0:
-                                draw.text((line_pos[0] + dx, line_pos[1] + dy), line, 
-                                        font=font, fill=outline_color_parsed)
-                    line_index += 1
-            
-            # 绘制每一行文字
-            line_index = 0
-            for line in lines:
-                if not line.strip():  # 跳过空行
-                    continue
-                    
-                line_y = start_y + line_index * line_height
-                line_pos = (pos[0], line_y)
-                
-                # 绘制加粗效果（通过多次绘制实现加粗效果）
-                bold_offset = 1  # 加粗偏移量
-                for dx in range(-bold_offset, bold_offset + 1):
-                    for dy in range(-bold_offset, bold_offset + 1):
-                        if dx == 0 and dy == 0:
-                            continue  # 跳过原始位置
-                        draw.text((line_pos[0] + dx, line_pos[1] + dy), line, 
-                                font=font, fill=text_color + (255,))
-                
-                # 绘制主文字
-                draw.text(line_pos, line, font=font, fill=text_color + (255,))
-                line_index += 1
-            
-            # 合并图层
-            result = Image.alpha_composite(image, text_layer)
+            result = self._render(image_path, text, font_name, font_size, color, position,
+                                  outline_color, outline_width, render_mode, layout_hint,
+                                  wrap=wrap, fit=fit, min_font_size=min_font_size,
+                                  default_position=default_position)
             
             # 保存图片
             if output_path is None:
                 name, ext = os.path.splitext(image_path)
                 output_path = f"{name}_with_text{ext}"
             
-            # 根据输出格式转换图片模式
-            output_ext = os.path.splitext(output_path)[1].lower()
-            if output_ext in ['.jpg', '.jpeg']:
-                # JPEG格式不支持透明通道，转换为RGB
-                result = result.convert('RGB')
-            elif output_ext == '.png':
-                # PNG格式保持RGBA
-                pass
-            else:
-                # 其他格式转换为RGB
-                result = result.convert('RGB')
+            self._save_image(result, output_path, jpeg_preset, quality=quality, effort=effort,
+                             encode_threads=encode_threads)
             
-            result.save(output_path)
-            
-            print(f"✅ 成功添加文字到图片: {output_path}")
+            self._log(f"✅ 成功添加文字到图片: {output_path}")
             return output_path
             
         except Exception as e:
-            print(f"❌ 错误: {str(e)}")
+            self.last_error = str(e)
+            self._log(f"❌ 错误: {str(e)}")
             return None
     
+    def render_to_bytes(self, image, text, image_format=None,
+                        font_name="arial", font_size=40,
+                        color="black", position=None,
+                        outline_color=None, outline_width=0,
+                        render_mode="fast", jpeg_preset="fast", layout_hint=None,
+                        filename=None, as_stream=False,
+                        wrap=False, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE,
+                        default_position="top-left", quality=None, effort=None, encode_threads=None):
+        """
+        给图片添加文字，返回编码后的图片数据，不读写临时文件
+        
+        参数与 add_text_to_image 相同，另外:
+        - image: 图片路径、图片数据（bytes）、文件对象或 PIL.Image（不会修改传入的图片）
+        - image_format: 输出格式（如 JPEG、PNG、WEBP、AVIF），默认与输入图片的格式一致
+        - filename: 原始文件名（可选），输入不是路径时用它解析位置和字体大小；
+          也可以直接通过 layout_hint 提供
+        - as_stream: 为True时返回定位到开头的 BytesIO，否则返回 bytes
+        
+        出错时直接抛出异常
+        """
+        if layout_hint is None and filename:
+            layout_hint = self.parse_position_and_size_from_filename(filename)
+        
+        if isinstance(image, (str, os.PathLike)):
+            image_path = image
+            source = None
+            source_format = Image.registered_extensions().get(os.path.splitext(image)[1].lower())
+        else:
+            image_path = None
+            if isinstance(image, Image.Image):
+                image.load()
+                source = image.copy()
+                source_format = image.format
+            else:
+                source = self._decode_source(image)
+                source_format = source.format
+        
+        if image_format is None:
+            if filename:
+                image_format = Image.registered_extensions().get(os.path.splitext(filename)[1].lower())
+            image_format = image_format or source_format or "PNG"
+        
+        result = self._render(image_path, text, font_name, font_size, color, position,
+                              outline_color, outline_width, render_mode, layout_hint,
+                              log=False, image=source, wrap=wrap, fit=fit,
+                              min_font_size=min_font_size, default_position=default_position)
+        buffer = io.BytesIO()
+        self._save_image(result, buffer, jpeg_preset, image_format, quality=quality, effort=effort,
+                         encode_threads=encode_threads)
+        if as_stream:
+            buffer.seek(0)
+            return buffer
+        return buffer.getvalue()
+    
+    def _render(self, image_path, text, font_name, font_size, color, position,
+                outline_color, outline_width, render_mode, layout_hint=None, log=True, image=None,
+                wrap=False, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE, default_position="top-left"):
+        """
+        确定布局、解码模板并绘制文字，返回结果图片
+        
+        提供已解码的 image 时直接在它上面绘制，image_path 只用于从文件名解析布局（可以为None）
+        """
+        position, font_size = self._resolve_layout(image_path, position, font_size, log=log,
+                                                   layout_hint=layout_hint,
+                                                   default_position=default_position)
+        if image is None:
+            image = self._open_image(image_path, render_mode)
+        else:
+            image = self._prepare_image(image, render_mode)
+        return self._draw_text(image, text, font_name, font_size, color, position,
+                               outline_color, outline_width, render_mode, image_path,
+                               wrap=wrap, fit=fit, min_font_size=min_font_size)
+    
+    def _resolve_layout(self, image_path, position, font_size, log=True, layout_hint=None,
+                        default_position="top-left"):
+        """结合文件名中的信息（或已解析好的布局提示）确定文字位置和字体大小"""
+        if layout_hint is not None:
+            parsed_position, parsed_font_size = layout_hint
+        else:
+            # 尝试从文件名解析位置和字体大小
+            parsed_position, parsed_font_size = self.parse_position_and_size_from_filename(image_path)
+        
+        # 处理位置解析
+        if position is None:
+            if parsed_position:
+                x_part, y_part = parsed_position
+                position = f"{x_part},{y_part}"
+                if log:
+                    self._log(f"📋 从文件名解析位置: {position}")
+            else:
+                position = default_position
+                if log:
+                    self._log(f"📋 使用默认位置: {position}")
+        
+        # 处理字体大小解析
+        if parsed_font_size is not None:
+            font_size = parsed_font_size
+            if log:
+                self._log(f"📋 从文件名解析字体大小: {font_size}")
+        
+        return position, font_size
+    
+    def _open_image(self, image_path, render_mode="fast"):
+        """打开并解码图片，转换为绘制需要的模式"""
+        # 打开图片（启用模板缓存时使用缓存中已解码图片的副本）
+        # fast模式下RGB图片（如JPEG）直接在RGB上绘制，不经过RGBA转换
+        t = self.timer.start()
+        if self.template_cache is not None:
+            image = self.template_cache.get(image_path, self._decode_image)
+        else:
+            image = self._decode_image(image_path)
+        self.timer.stop('open', t)
+        return self._prepare_image(image, render_mode)
+    
+    def _prepare_image(self, image, render_mode="fast"):
+        """转换为绘制需要的模式"""
+        t = self.timer.start()
+        if image.mode != 'RGBA' and not (render_mode != "legacy" and image.mode == 'RGB'):
+            image = image.convert('RGBA')
+        image.load()
+        self.timer.stop('convert', t)
+        return image
+    
+    def _decode_source(self, source):
+        """解码内存中的图片数据（bytes 或文件对象）"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        image.load()
+        return image
+    
+    def _decode_image(self, image_path):
+        """解码图片，启用磁盘像素缓存时直接从缓存文件读取像素"""
+        if self.pixel_cache is not None:
+            return self.pixel_cache.load(image_path)
+        image = Image.open(image_path)
+        image.load()
+        return image
+    
+    def _text_area(self, image_size, position):
+        """
+        文字可用区域 (left, top, width, height)
+        
+        与模板索引中的 text_area 算法相同：从文件名中的坐标到图片边缘（保留边距），
+        预定义位置和居中时为整张图片减去边距
+        """
+        parsed = None
+        if isinstance(position, (tuple, list)) and len(position) == 2:
+            parsed = tuple(position)
+        elif isinstance(position, str) and ',' in position:
+            parts = [part.strip() for part in position.split(',')]
+            if len(parts) == 2:
+                parsed = tuple(int(part) if part.lstrip('-').isdigit() else part for part in parts)
+        return compute_text_area(image_size, parsed)
+    
+    def _line_metrics(self, font, font_key, font_size, render_mode="fast"):
+        """
+        返回 (width_of, 行高, 行间距)
+        
+        fast 模式按字体度量计算：行宽为前进宽度，行高为 ascent + descent + 行间距；
+        legacy 模式保持原来的算法（边界框宽度，字号 + 行间距），输出与以前完全一致
+        """
+        if render_mode == "legacy":
+            return (lambda line: self.measurer.width(font, font_key, line)), font_size + LINE_SPACING, 0
+        metrics = self.measurer.metrics(font, font_key)
+        width_of = lambda line: math.ceil(metrics.advance(line))
+        return width_of, metrics.line_height + LINE_SPACING, LINE_SPACING
+    
+    def measure_text_block(self, text, font_name, font_size, render_mode="fast"):
+        """
+        不打开任何图片，计算文字块尺寸，返回 (宽度, 高度)
+        
+        只用到字体度量，每行只需要几微秒，可以在批量处理前预先检查所有文字
+        """
+        font = self.get_font(font_name, font_size)
+        font_key = (self._resolve_font_path(font_name), font_size)
+        width_of, line_height, line_gap = self._line_metrics(font, font_key, font_size, render_mode)
+        non_empty = [line for line in text.split('\n') if line.strip()]
+        width = max((width_of(line) for line in non_empty), default=0)
+        return width, max(len(non_empty) * line_height - line_gap, 0)
+    
+    def layout_text(self, text, font_name, font_size, image_size, position,
+                    wrap=True, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE, render_mode="fast"):
+        """
+        在不绘制的情况下排版文字，返回 TextLayout
+        
+        参数:
+        - text: 文字
+        - font_name: 字体名称
+        - font_size: 字号（fit=True 时为最大字号）
+        - image_size: 图片尺寸
+        - position: 文字位置（与 add_text_to_image 相同的格式）
+        - wrap: 按可用宽度自动换行
+        - fit: 放不下时缩小字号，最小到 min_font_size
+        - render_mode: 渲染模式，决定使用的行高和行宽算法
+        
+        返回结果的 overflow 为True时表示即使换行、缩小字号后仍然放不下
+        """
+        _, _, area_width, area_height = self._text_area(image_size, position)
+        font_path = self._resolve_font_path(font_name)
+        
+        line_gap = 0 if render_mode == "legacy" else LINE_SPACING
+        
+        def measure_at(size):
+            font = self.get_font(font_name, size)
+            width_of, line_height, _ = self._line_metrics(font, (font_path, size), size, render_mode)
+            return width_of, line_height
+        
+        return layout_text(text, area_width, area_height, font_size, measure_at,
+                           wrap=wrap, fit=fit, min_font_size=min_font_size, line_gap=line_gap)
+    
+    def _draw_text(self, image, text, font_name, font_size, color, position,
+                   outline_color=None, outline_width=0, render_mode="fast", image_path=None,
+                   wrap=False, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE, log=True):
+        """
+        在已解码的图片上绘制文字，返回结果图片（fast模式下原地修改）
+        
+        文字块超出可用区域时记录在 last_overflow 中；log=False 时不输出提示信息（由调用方报告）
+        """
+        timer = self.timer
+        t = timer.start()
+        
+        # 自动换行 / 缩小字号：先排版，确定每行文字和最终字号
+        if wrap or fit:
+            layout = self.layout_text(text, font_name, font_size, image.size, position,
+                                      wrap=wrap or fit, fit=fit, min_font_size=min_font_size,
+                                      render_mode=render_mode)
+            if layout.font_size != font_size:
+                self._log(f"📐 自动缩小字号: {font_size} -> {layout.font_size}")
+            text = layout.text
+            font_size = layout.font_size
+        
+        # 获取字体
+        font = self.get_font(font_name, font_size)
+        font_key = (self._resolve_font_path(font_name), font_size)
+        t = timer.stop('font', t)
+        
+        # 解析颜色（auto 时在确定位置后按背景亮度选择）
+        auto_color = self.is_auto_color(color)
+        text_color = None if auto_color else self.parse_color(color)
+        outline_color_parsed = None
+        if outline_color:
+            outline_color_parsed = self.parse_color(outline_color)
+        
+        # 获取文字尺寸（处理多行文字，空行不占位置）
+        non_empty_lines = [line for line in text.split('\n') if line.strip()]
+        # 行高和行宽来自字体度量（legacy 模式为字号 + 行间距和边界框宽度）
+        width_of, line_height, line_gap = self._line_metrics(font, font_key, font_size, render_mode)
+        
+        # 计算最大行宽度（测量结果会被记住，绘制时不再重复测量）
+        text_width = max((width_of(line) for line in non_empty_lines), default=0)
+        # 最后一行之后的行间距不计入文字块高度，垂直居中时按实际行高计算
+        text_height = max(len(non_empty_lines) * line_height - line_gap, 0)
+        
+        # 在绘制之前检查文字块是否超出可用区域
+        area_width, area_height = self._text_area(image.size, position)[2:]
+        self.last_overflow = None
+        if text_width > area_width or text_height > area_height:
+            self.last_overflow = (text_width, text_height, area_width, area_height)
+            if log:
+                self._log(self.overflow_message(self.last_overflow))
+        
+        # 解析位置（auto 时按画面内容选择最平坦的区域，放不下时居中）
+        pos = None
+        if isinstance(position, str) and position.strip().lower() == 'auto':
+            pos = find_calm_position(image, (text_width, text_height))
+            if pos is not None and log:
+                self._log(f"🧭 自动选择文字位置: {pos[0]},{pos[1]}")
+            else:
+                position = 'center'
+        if pos is None:
+            pos = self.parse_position(position, image.size, (text_width, text_height), image_path)
+        
+        if auto_color:
+            text_color, auto_outline = pick_text_colors(
+                image, (pos[0], pos[1], pos[0] + text_width, pos[1] + text_height))
+            # 用户指定的描边优先
+            if auto_outline is not None and outline_color_parsed is None:
+                outline_color_parsed = auto_outline
+                outline_width = outline_width or max(1, round(font_size / AUTO_OUTLINE_RATIO))
+            if log:
+                self._log(f"🎨 自动选择文字颜色: {text_color}"
+                          + (f"，描边 {outline_color_parsed} {outline_width}px" if outline_color_parsed else ""))
+        
+        # 基于解析出的位置计算起始位置
+        # pos[1] 是解析出的Y坐标，这应该是文字区域top距离图片顶部的距离
+        start_y = pos[1]
+        
+        # 每个非空行的绘制位置
+        line_positions = [((pos[0], start_y + line_index * line_height), line)
+                          for line_index, line in enumerate(non_empty_lines)]
+        t = timer.stop('measure', t)
+        
+        if render_mode == "legacy":
+            # 创建全图大小的透明图层用于文字
+            text_layer = Image.new('RGBA', image.size, (255, 255, 255, 0))
+            draw = ImageDraw.Draw(text_layer)
+            self._draw_lines_legacy(draw, line_positions, font, text_color,
+                                    outline_color_parsed, outline_width)
+            t = timer.stop('draw', t)
+            
+            # 合并图层
+            result = Image.alpha_composite(image, text_layer)
+            timer.stop('composite', t)
+        else:
+            result = image
+            if line_positions:
+                # 所有效果共用同一个文字蒙版，图层只有文字块大小
+                outline_width = outline_width if outline_color_parsed else 0
+                mask, origin = self._build_text_mask(line_positions, font, outline_width + 1, font_key)
+                block_layer = self._compose_text_layer(mask, text_color,
+                                                       outline_color_parsed, outline_width)
+                t = timer.stop('draw', t)
+                self._composite_region(result, block_layer, origin)
+                timer.stop('composite', t)
+        
+        return result
+    
+    def _save_image(self, image, output_path, jpeg_preset="fast", image_format=None,
+                    quality=None, effort=None, encode_threads=None):
+        """
+        按输出格式转换图片模式并保存，不写入原图的EXIF等元数据
+        
+        output_path 也可以是文件对象，此时需要通过 image_format 指定格式；
+        quality、effort、encode_threads 的含义见 ENCODER_RANGES
+        """
+        t = self.timer.start()
+        # 根据输出格式转换图片模式
+        if image_format is None:
+            output_ext = os.path.splitext(output_path)[1].lower()
+            image_format = Image.registered_extensions().get(output_ext)
+        image_format = (image_format or '').upper()
+        if image_format == 'JPG':
+            image_format = 'JPEG'
+        save_params = self._encoder_params(image_format, jpeg_preset, quality, effort, encode_threads)
+        if image_format == 'JPEG':
+            # JPEG格式不支持透明通道，转换为RGB
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+        elif image_format == 'PNG':
+            # PNG格式保持RGBA
+            pass
+        elif image.mode != 'RGB':
+            # 其他格式转换为RGB
+            image = image.convert('RGB')
+        
+        t = self.timer.stop('convert', t)
+        
+        # 去掉从原图带过来的元数据（EXIF、注释等）
+        image.info = {}
+        image.save(output_path, format=image_format or None, **save_params)
+        self.timer.stop('save', t)
+    
+    def _encoder_params(self, image_format, jpeg_preset="fast", quality=None, effort=None,
+                        encode_threads=None):
+        """根据输出格式和编码参数生成 Image.save 的参数，参数超出范围时抛出 ValueError"""
+        ranges = ENCODER_RANGES.get(image_format, {})
+        for name, value in (('quality', quality), ('effort', effort)):
+            if value is None:
+                continue
+            if name not in ranges:
+                raise ValueError(f"{image_format or '该'}格式不支持 {name} 参数")
+            low, high = ranges[name]
+            if not low <= value <= high:
+                raise ValueError(f"{image_format} 的 {name} 应在 {low}-{high} 之间: {value}")
+        if encode_threads is not None and encode_threads < 1:
+            raise ValueError(f"编码线程数应至少为1: {encode_threads}")
+        
+        if image_format == 'JPEG':
+            if jpeg_preset not in JPEG_PRESETS:
+                raise ValueError(f"未知的JPEG编码预设: {jpeg_preset}，可选: {', '.join(JPEG_PRESETS)}")
+            params = dict(JPEG_PRESETS[jpeg_preset])
+            if quality is not None:
+                params['quality'] = quality
+            return params
+        
+        params = {}
+        if image_format == 'PNG':
+            if effort is not None:
+                params['compress_level'] = effort
+                params['optimize'] = effort >= 9
+        elif image_format == 'WEBP':
+            if quality is not None:
+                params['quality'] = quality
+            if effort is not None:
+                params['method'] = effort
+        elif image_format == 'AVIF':
+            if quality is not None:
+                params['quality'] = quality
+            if effort is not None:
+                params['speed'] = 10 - effort
+            if encode_threads:
+                params['max_threads'] = encode_threads
+        return params
+    
+    def check_output_format(self, output_format, quality=None, effort=None, encode_threads=None):
+        """
+        检查批量输出格式是否可用（AVIF需要Pillow支持）以及编码参数是否在范围内，
+        在开始处理之前调用；不可用时打印原因并返回False
+        """
+        if output_format not in OUTPUT_FORMATS:
+            print(f"❌ 未知的输出格式: {output_format}，可选: {', '.join(OUTPUT_FORMATS)}")
+            return False
+        image_format = OUTPUT_FORMATS[output_format][0]
+        Image.init()
+        if image_format not in Image.SAVE:
+            print(f"❌ 当前Pillow不支持保存 {image_format} 格式，请升级Pillow或安装带有对应编码库的版本")
+            return False
+        return self.check_encode_options(image_format, quality, effort, encode_threads)
+    
+    def check_encode_options(self, image_format, quality=None, effort=None, encode_threads=None):
+        """检查编码参数是否适用于 image_format（如 JPEG、PNG）且在范围内，不适用时打印原因并返回False"""
+        try:
+            self._encoder_params(image_format, quality=quality, effort=effort, encode_threads=encode_threads)
+        except ValueError as e:
+            print(f"❌ 错误: {e}")
+            return False
+        return True
+    
+    def _build_text_mask(self, line_positions, font, pad, font_key=None):
+        """
+        把每个非空行光栅化一次，合成为整个文字块的L模式蒙版
+        
+        返回 (蒙版, 蒙版左上角在图片中的坐标)，蒙版四周留出 pad 像素
+        给加粗和描边的外扩使用；提供 font_key 时使用测量缓存
+        """
+        if font_key is not None:
+            line_boxes = [self.measurer.bbox(font, font_key, line) for _, line in line_positions]
+        else:
+            line_boxes = [font.getbbox(line) for _, line in line_positions]
+        left = min(line_pos[0] + box[0] for (line_pos, _), box in zip(line_positions, line_boxes)) - pad
+        top = min(line_pos[1] + box[1] for (line_pos, _), box in zip(line_positions, line_boxes)) - pad
+        right = max(line_pos[0] + box[2] for (line_pos, _), box in zip(line_positions, line_boxes)) + pad
+        bottom = max(line_pos[1] + box[3] for (line_pos, _), box in zip(line_positions, line_boxes)) + pad
+        
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        mask_draw = ImageDraw.Draw(mask)
+        for line_pos, line in line_positions:
+            mask_draw.text((line_pos[0] - left, line_pos[1] - top), line, font=font, fill=255)
+        return mask, (left, top)
+    
+    def _dilate_mask(self, mask, radius):
+        """
+        用方形结构元素把蒙版向外扩展 radius 像素
+        
+        等效于原来在 (2r+1)² 个偏移位置重复绘制，按行、列分离并倍增步长，
+        只需要 O(log r) 次图像运算
+        """
+        for axis in (0, 1):
+            reach = 0
+            while reach < radius:
+                step = min(2 * reach + 1, radius - reach)
+                offset = (step, 0) if axis == 0 else (0, step)
+                shifted_forward = Image.new('L', mask.size, 0)
+                shifted_forward.paste(mask, offset)
+                shifted_back = Image.new('L', mask.size, 0)
+                shifted_back.paste(mask, (-offset[0], -offset[1]))
+                mask = ImageChops.lighter(mask, ImageChops.lighter(shifted_forward, shifted_back))
+                reach += step
+        return mask
+    
+    def _compose_text_layer(self, mask, text_color, outline_color, outline_width):
+        """
+        由文字蒙版生成RGBA文字图层
+        
+        - 加粗：蒙版扩展1像素（对应原来的3x3偏移重绘）
+        - 描边：蒙版扩展 outline_width 像素，填充描边颜色
+        - 填充：在描边之上用文字颜色着色
+        """
+        fill_mask = self._dilate_mask(mask, 1)
+        
+        if outline_color and outline_width > 0:
+            outline_mask = self._dilate_mask(mask, outline_width)
+            layer = Image.new('RGB', mask.size, outline_color)
+            layer.paste(text_color, (0, 0) + mask.size, fill_mask)
+            layer.putalpha(ImageChops.lighter(outline_mask, fill_mask))
+        else:
+            layer = Image.new('RGB', mask.size, text_color)
+            layer.putalpha(fill_mask)
+        return layer
+    
+    def _composite_region(self, image, layer, origin):
+        """
+        只在文字块覆盖的区域内把图层混合到图片上（原地修改）
+        
+        RGB底图直接用图层的alpha作为蒙版粘贴，RGBA底图做alpha混合
+        """
+        left, top = origin
+        # 裁掉超出图片边界的部分
+        crop_left, crop_top = max(left, 0), max(top, 0)
+        crop_right = min(left + layer.width, image.width)
+        crop_bottom = min(top + layer.height, image.height)
+        if crop_left >= crop_right or crop_top >= crop_bottom:
+            return
+        
+        if (crop_left, crop_top, crop_right, crop_bottom) != (left, top, left + layer.width, top + layer.height):
+            layer = layer.crop((crop_left - left, crop_top - top,
+                                crop_right - left, crop_bottom - top))
+        if image.mode == 'RGBA':
+            image.alpha_composite(layer, (crop_left, crop_top))
+        else:
+            image.paste(layer, (crop_left, crop_top), layer)
+    
+    def _draw_lines_legacy(self, draw, line_positions, font, text_color,
+                           outline_color, outline_width):
+        """原来的多次偏移重绘方式，输出与旧版本逐像素一致"""
+        # 绘制描边（如果有）- 支持多行文字
+        if outline_color and outline_width > 0:
+            for line_pos, line in line_positions:
+                for dx in range(-outline_width, outline_width + 1):
+                    for dy in range(-outline_width, outline_width + 1):
+                        if dx != 0 or dy != 0:
+                            draw.text((line_pos[0] + dx, line_pos[1] + dy), line, 
+                                    font=font, fill=outline_color)
+        
+        # 绘制每一行文字
+        for line_pos, line in line_positions:
+            # 绘制加粗效果（通过多次绘制实现加粗效果）
+            bold_offset = 1  # 加粗偏移量
+            for dx in range(-bold_offset, bold_offset + 1):
+                for dy in range(-bold_offset, bold_offset + 1):
+                    if dx == 0 and dy == 0:
+                        continue  # 跳过原始位置
+                    draw.text((line_pos[0] + dx, line_pos[1] + dy), line, 
+                            font=font, fill=text_color + (255,))
+            
+            # 绘制主文字
+            draw.text(line_pos, line, font=font, fill=text_color + (255,))
+    
     def list_available_fonts(self):
         """列出可用字体"""
         print("📝 可用字体:")
@@ -452,79 +1304,82 @@ class ImageTextAdder:
         print("  垂直居中: 100,vcenter (水平坐标100，垂直居中)")
         print("  水平居中: center,200 (水平居中，垂直坐标200)")
         print("  完全居中: center,center 或 vcenter")
+        print("  自动选择: auto (放在画面最平坦的区域)")
     
     def parse_text_paragraphs(self, text_file_path):
         """从文本文件中解析段落，以连续两个换行为界限"""
+        cleaned_paragraphs = list(self.iter_text_paragraphs(text_file_path))
+        self._log(f"📖 从 {text_file_path} 中解析出 {len(cleaned_paragraphs)} 个段落")
+        return cleaned_paragraphs
+    
+    def iter_text_paragraphs(self, text_file_path):
+        """
+        逐段读取文本文件中的段落（生成器）
+        
+        规则与 parse_text_paragraphs 相同：忽略以#开头的行，空白行为段落分界，
+        段落去除首尾空白但保留换行。按行读取文件，内存占用与文件大小无关
+        """
         try:
             with open(text_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 过滤以#开头的行（忽略前导空白）
-            content_lines = content.splitlines()
-            content_lines = [line for line in content_lines if not line.lstrip().startswith('#')]
-            content = '\n'.join(content_lines)
-            
-            # 按连续两个换行符分割段落
-            paragraphs = re.split(r'\n\s*\n', content)
-            
-            # 清理段落内容
-            cleaned_paragraphs = []
-            for para in paragraphs:
-                # 去除首尾空白，但保持换行符用于多行显示
-                cleaned = para.strip()
-                if cleaned:  # 只保留非空段落
-                    cleaned_paragraphs.append(cleaned)
-            
-            print(f"📖 从 {text_file_path} 中解析出 {len(cleaned_paragraphs)} 个段落")
-            return cleaned_paragraphs
-            
+                block = []
+                for raw_line in f:
+                    for line in raw_line.splitlines():
+                        # 过滤以#开头的行（忽略前导空白）
+                        if line.lstrip().startswith('#'):
+                            continue
+                        if line.strip():
+                            block.append(line)
+                        elif block:
+                            # 空白行是段落分界
+                            yield '\n'.join(block).strip()
+                            block = []
+                if block:
+                    yield '\n'.join(block).strip()
         except Exception as e:
             print(f"❌ 读取文本文件失败: {str(e)}")
-            return []
+    
+    def _read_paragraphs(self, text_file_path, limit):
+        """
+        读取最多 limit 个段落，返回 (段落列表, 剩余段落的生成器)
+        
+        图片数量决定了最多能用多少个段落，剩下的段落只在最后统计数量时逐个读取
+        """
+        remaining = self.iter_text_paragraphs(text_file_path)
+        paragraphs = list(itertools.islice(remaining, limit))
+        self._log(f"📖 从 {text_file_path} 中读取了 {len(paragraphs)} 个段落")
+        return paragraphs, remaining
+    
+    def get_template_index(self, folder_path):
+        """获取模板文件夹的索引（同一个文件夹只创建一次）"""
+        key = os.path.abspath(folder_path)
+        index = self._template_indexes.get(key)
+        if index is None:
+            index = TemplateIndex(folder_path, self.parse_position_and_size_from_filename)
+            self._template_indexes[key] = index
+        return index
     
     def get_image_files(self, folder_path):
         """获取文件夹中的图片文件，按文件名排序，排除已处理的文件"""
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif', '*.tiff']
-        image_files = []
-        
-        for ext in image_extensions:
-            pattern = os.path.join(folder_path, ext)
-            image_files.extend(glob.glob(pattern))
-            pattern = os.path.join(folder_path, ext.upper())
-            image_files.extend(glob.glob(pattern))
-        
-        # 去重并过滤掉已处理的文件
-        unique_files = list(set(image_files))  # 去重
-        original_files = []
-        for file_path in unique_files:
-            filename = os.path.basename(file_path)
-            # 排除已处理的文件（包含 _text 或 _with_text 的文件）
-            if '_text' not in filename and '_with_text' not in filename:
-                original_files.append(file_path)
-        
-        # 按文件名第一个数值排序
-        def get_sort_key(filepath):
-            filename = os.path.basename(filepath)
-            # 用-分割，取第一部分
-            first_part = filename.split('-')[0]
-            try:
-                # 尝试提取数字
-                import re
-                numbers = re.findall(r'\d+', first_part)
-                if numbers:
-                    return int(numbers[0])
-                else:
-                    return 0
-            except:
-                return 0
+        # 从模板索引读取图片列表，不再按扩展名逐个扫描目录
+        image_files = [entry['path'] for entry in self.get_template_index(folder_path).refresh()]
+        
+        # 过滤掉已处理的文件（包含 _text 或 _with_text 的文件）
+        original_files = [file_path for file_path in image_files
+                          if '_text' not in os.path.basename(file_path)]
         
-        original_files.sort(key=get_sort_key)
-        print(f"🖼️  在 {folder_path} 中找到 {len(original_files)} 张原始图片")
+        # 按文件名第一个数值排序，排序键只计算一次
+        original_files.sort(key=lambda file_path: leading_number_key(os.path.basename(file_path)))
+        self._log(f"🖼️  在 {folder_path} 中找到 {len(original_files)} 张原始图片")
         return original_files
     
     def batch_process_images(self, folder_path, text_file_path, output_folder=None,
                            font_name="simkai", font_size=40, color="black", 
-                           position="center", outline_color=None, outline_width=0):
+                           position="center", outline_color=None, outline_width=0,
+                           render_mode="fast", jpeg_preset="fast", jobs=1,
+                           pipeline=False, incremental=False, render_cache_dir=None,
+                           render_cache_size_mb=DEFAULT_CACHE_SIZE_MB, wrap=False, fit=False,
+                           min_font_size=DEFAULT_MIN_FONT_SIZE, output_format="jpeg",
+                           quality=None, effort=None, encode_threads=None):
         """
         批量处理图片，将文本段落分配给图片
         
@@ -535,22 +1390,40 @@ class ImageTextAdder:
         - font_name: 字体名称
         - font_size: 字体大小
         - color: 文字颜色
-        - position: 文字位置
+        - position: 位置从文件名解析；为 auto 时，文件名中没有位置信息的图片自动选择画面最平坦的区域
         - outline_color: 描边颜色
         - outline_width: 描边宽度
+        - render_mode: 渲染模式，fast 或 legacy
+        - jpeg_preset: JPEG编码预设，fast、balanced 或 small
+        - jobs: 并行渲染的进程数，1为单进程，0或None表示使用全部CPU核心
+        - pipeline: 单进程时使用解码/渲染/编码流水线，并报告各阶段利用率
+        - incremental: 增量模式，输入没有变化的输出图片不重新渲染
+        - render_cache_dir: 增量模式下保存渲染结果的缓存目录（可选）
+        - render_cache_size_mb: 缓存目录的大小上限（MB）
+        - wrap: 按可用宽度自动换行
+        - fit: 文字块放不下时自动缩小字号
+        - min_font_size: 自动缩小字号时的最小字号
+        - output_format: 输出格式，jpeg、png、webp 或 avif
+        - quality: 编码质量（jpeg、webp、avif）
+        - effort: 压缩力度（png、webp、avif），越大文件越小、编码越慢
+        - encode_threads: 编码线程数（只有avif支持）
         """
         
-        # 解析文本段落
-        paragraphs = self.parse_text_paragraphs(text_file_path)
-        if not paragraphs:
-            print("❌ 没有找到有效的文本段落")
-            return
+        if not self.check_output_format(output_format, quality, effort, encode_threads):
+            return 0
         
         # 获取图片文件
         image_files = self.get_image_files(folder_path)
+        
+        # 逐段读取文本段落，只读取图片数量需要的部分（多读一段用于判断是否还有剩余）
+        paragraphs, remaining = self._read_paragraphs(text_file_path, len(image_files) + 1)
+        if not paragraphs:
+            print("❌ 没有找到有效的文本段落")
+            return 0
+        
         if not image_files:
             print("❌ 没有找到图片文件")
-            return
+            return 0
         
         # 设置输出文件夹
         if output_folder is None:
@@ -560,55 +1433,365 @@ class ImageTextAdder:
         os.makedirs(output_folder, exist_ok=True)
         
         # 处理图片和文本的配对
-        processed_count = 0
         min_count = min(len(paragraphs), len(image_files))
         
-        print(f"\n🔄 开始批量处理，将处理 {min_count} 张图片...")
+        self._log(f"\n🔄 开始批量处理，将处理 {min_count} 张图片...")
         
-        for i in range(min_count):
-            image_path = image_files[i]
-            text_content = paragraphs[i]
-            
-            # 生成输出文件名，添加数字前缀
-            image_name = os.path.splitext(os.path.basename(image_path))[0]
-            output_path = os.path.join(output_folder, f"{i+1}-{image_name}_text.jpg")
-            
-            print(f"\n📝 处理第 {i+1} 张图片: {os.path.basename(image_path)}")
-            print(f"   文本内容: {text_content[:30]}..." if len(text_content) > 30 else f"   文本内容: {text_content}")
-            
-            # 添加文字到图片（不传递position和font_size，让方法内部解析）
-            result = self.add_text_to_image(
-                image_path=image_path,
-                text=text_content,
-                output_path=output_path,
-                font_name=font_name,
-                font_size=font_size,
-                color=color,
-                position=None,  # 让方法内部从文件名解析
-                outline_color=outline_color,
-                outline_width=outline_width
-            )
-            
-            if result:
-                processed_count += 1
-                print(f"   ✅ 保存到: {output_path}")
-            else:
-                print(f"   ❌ 处理失败")
+        render_cache = None
+        if incremental:
+            render_cache = RenderCache(output_folder, render_cache_dir, render_cache_size_mb)
+        
+        render_options = self._build_render_options(
+            font_name, font_size, color, outline_color, outline_width, render_mode, jpeg_preset,
+            wrap, fit, min_font_size, position,
+            quality=quality, effort=effort, encode_threads=encode_threads
+        )
+        processed_count = self._process_pairs(
+            list(zip(image_files, paragraphs)), output_folder, render_options, jobs, pipeline,
+            render_cache, self.get_template_index(folder_path).layout_hints(), output_format
+        )
         
-        print(f"\n🎉 批量处理完成！成功处理 {processed_count} 张图片")
-        print(f"📁 输出文件夹: {output_folder}")
+        self._log(f"\n🎉 批量处理完成！成功处理 {processed_count} 张图片")
+        self._log(f"📁 输出文件夹: {output_folder}")
         
         # 显示剩余内容统计
         if len(paragraphs) > len(image_files):
-            print(f"⚠️  还有 {len(paragraphs) - len(image_files)} 个文本段落没有处理")
+            unused = len(paragraphs) - len(image_files) + sum(1 for _ in remaining)
+            print(f"⚠️  还有 {unused} 个文本段落没有处理")
         elif len(image_files) > len(paragraphs):
             print(f"⚠️  还有 {len(image_files) - len(paragraphs)} 张图片没有使用")
         
         return processed_count
     
+    def _build_render_options(self, font_name, font_size, color, outline_color, outline_width,
+                              render_mode, jpeg_preset, wrap=False, fit=False,
+                              min_font_size=DEFAULT_MIN_FONT_SIZE, position=None, **encode_options):
+        """
+        批量和自动处理共用的渲染参数（传给 add_text_to_image 和工作进程）
+        
+        排版、自动位置和编码参数（ENCODE_OPTIONS）只在启用或指定时加入，
+        保持增量渲染的键和自动处理标记与以前一致
+        """
+        render_options = dict(
+            font_name=font_name,
+            font_size=font_size,
+            color=color,
+            outline_color=outline_color,
+            outline_width=outline_width,
+            render_mode=render_mode,
+            jpeg_preset=jpeg_preset
+        )
+        if wrap or fit:
+            render_options.update(wrap=wrap, fit=fit, min_font_size=min_font_size)
+        if position == 'auto':
+            render_options['default_position'] = 'auto'
+        for key in ENCODE_OPTIONS:
+            if encode_options.get(key) is not None:
+                render_options[key] = encode_options[key]
+        return render_options
+    
+    def _process_pairs(self, pairs, output_folder, render_options, jobs=1, pipeline=False,
+                       render_cache=None, layout_hints=None, output_format="jpeg"):
+        """
+        渲染 (图片路径, 文本) 配对，返回成功处理的数量
+        
+        jobs > 1 时在进程池中并行渲染；pipeline=True（且单进程）时使用
+        解码/渲染/编码流水线。输出文件名和打印顺序与单进程一致。
+        指定 render_cache 时，输入没有变化的图片会被跳过或从缓存复制。
+        layout_hints 为 {图片路径: (位置, 字体大小)}，通常来自模板索引；
+        output_format 决定输出文件的扩展名（见 OUTPUT_FORMATS）
+        """
+        layout_hints = layout_hints or {}
+        output_ext = OUTPUT_FORMATS[output_format][1]
+        tasks = []
+        for i, (image_path, text_content) in enumerate(pairs):
+            # 生成输出文件名，添加数字前缀
+            image_name = os.path.splitext(os.path.basename(image_path))[0]
+            output_path = os.path.join(output_folder, f"{i+1}-{image_name}_text{output_ext}")
+            tasks.append((image_path, text_content, output_path, layout_hints.get(image_path)))
+        
+        # 增量模式：先找出不需要重新渲染的图片
+        cache_keys = {}
+        reused = {}
+        if render_cache is not None:
+            for i, (image_path, text_content, output_path, layout_hint) in enumerate(tasks):
+                try:
+                    key = self._render_cache_key(render_cache, image_path, text_content,
+                                                 render_options, layout_hint, output_format)
+                except OSError:
+                    continue
+                cache_keys[i] = key
+                if render_cache.is_current(output_path, key):
+                    reused[i] = ('skipped', "⏭️  输入未变化，跳过")
+                    render_cache.skipped += 1
+                elif render_cache.restore(output_path, key):
+                    reused[i] = ('copied', "♻️  从渲染缓存复制")
+                    render_cache.copied += 1
+        render_tasks = [task for i, task in enumerate(tasks) if i not in reused]
+        
+        if jobs is None or jobs <= 0:
+            jobs = os.cpu_count() or 1
+        # 复用进程池时（多文件夹自动处理）按请求的进程数创建，待渲染图片少的文件夹不会替换掉进程池
+        pool_size = jobs if self.keep_render_pool else min(jobs, len(render_tasks))
+        jobs = min(jobs, len(render_tasks))
+        if jobs > 1 and output_format == 'avif' and render_options.get('encode_threads') is None:
+            # 多进程时每个进程的AVIF编码器只用分到的CPU核心，避免线程过多互相抢占
+            render_options = dict(render_options, encode_threads=max(1, (os.cpu_count() or 1) // pool_size))
+        render_pipeline = None
+        if jobs > 1:
+            results = self._render_in_pool(render_tasks, render_options, pool_size)
+        elif pipeline and render_tasks:
+            render_pipeline = RenderPipeline(self, render_options)
+            results = render_pipeline.run(render_tasks)
+        else:
+            results = None
+        
+        processed_count = 0
+        timer = self.timer
+        events = self.events
+        batch_started = timer.start()
+        if events is not None:
+            events.emit('batch_start', total=len(tasks), output_folder=output_folder, jobs=jobs)
+            events_started = time.perf_counter()
+        try:
+            for i, (image_path, text_content, output_path, layout_hint) in enumerate(tasks):
+                t = timer.start()
+                started = time.perf_counter() if events is not None else 0.0
+                self._log(f"\n📝 处理第 {i+1} 张图片: {os.path.basename(image_path)}")
+                self._log(f"   文本内容: {text_content[:30]}..." if len(text_content) > 30 else f"   文本内容: {text_content}")
+                
+                if i in reused:
+                    processed_count += 1
+                    status, message = reused[i]
+                    self._log(f"   {message}: {output_path}")
+                    if events is not None:
+                        self._emit_image_event(i, image_path, output_path, status,
+                                               time.perf_counter() - started)
+                    continue
+                
+                if results is None:
+                    # 添加文字到图片（不传递position，让方法内部从文件名解析）
+                    render_started = time.perf_counter()
+                    result = self.add_text_to_image(
+                        image_path=image_path,
+                        text=text_content,
+                        output_path=output_path,
+                        position=None,
+                        layout_hint=layout_hint,
+                        **render_options
+                    )
+                    duration = time.perf_counter() - render_started
+                    error = self.last_error
+                    overflow = self.last_overflow
+                    # verbose 时 add_text_to_image 已经输出过错误和超出提示
+                    if error and not self.verbose:
+                        self._log_error(f"   ❌ 错误: {error}")
+                    if overflow and not self.verbose:
+                        self._log_error(f"   {self.overflow_message(overflow)}")
+                else:
+                    # 多进程和流水线的耗时由处理这张图片的进程或线程自己计时，不包括在这里等待的时间
+                    result, error, duration, overflow = next(results)
+                    if error:
+                        self._log_error(f"   ❌ 错误: {error}")
+                    if overflow:
+                        self._log_error(f"   {self.overflow_message(overflow)}")
+                
+                if result:
+                    processed_count += 1
+                    self._log(f"   ✅ 保存到: {output_path}")
+                    if i in cache_keys:
+                        render_cache.store(output_path, cache_keys[i])
+                        render_cache.rendered += 1
+                else:
+                    self._log_error(f"   ❌ 处理失败: {os.path.basename(image_path)}")
+                timer.stop('image', t)
+                if events is not None:
+                    self._emit_image_event(i, image_path, output_path, 'ok' if result else 'failed',
+                                           duration, error, overflow)
+        finally:
+            timer.stop('batch', batch_started)
+            if events is not None:
+                events.emit('batch_end', processed=processed_count, failed=len(tasks) - processed_count,
+                            duration_ms=round((time.perf_counter() - events_started) * 1000, 3))
+            if results is not None:
+                results.close()
+            if render_cache is not None:
+                render_cache.save()
+                render_cache.evict()
+        
+        if render_pipeline is not None and self.verbose:
+            render_pipeline.print_stats()
+        
+        # 多进程时每个工作进程有自己的模板缓存，这里只统计本进程
+        if self.template_cache is not None and jobs <= 1 and self.verbose:
+            self.print_template_cache_stats()
+        
+        if render_cache is not None:
+            self._log(f"\n♻️  增量渲染: 重新渲染 {render_cache.rendered} 张，"
+                      f"跳过 {render_cache.skipped} 张，从缓存复制 {render_cache.copied} 张")
+        
+        return processed_count
+    
+    def _emit_image_event(self, index, image_path, output_path, status, duration, error=None,
+                          overflow=None):
+        """
+        写一条单张图片的事件记录（index 为段落序号，从0开始，duration 为处理这张图片的秒数）
+        
+        overflow 为 last_overflow 的值，文字块超出可用区域时记录文字和可用区域的尺寸
+        """
+        nbytes = 0
+        if status != 'failed':
+            try:
+                nbytes = os.path.getsize(output_path)
+            except OSError:
+                pass
+        self.events.emit('image', index=index, input=image_path,
+                         output=output_path if status != 'failed' else None,
+                         status=status, bytes=nbytes,
+                         duration_ms=round(duration * 1000, 3),
+                         error=error,
+                         overflow={'text': list(overflow[:2]), 'area': list(overflow[2:])} if overflow else None)
+    
+    def print_template_cache_stats(self):
+        """打印模板缓存命中率"""
+        stats = self.template_cache.stats()
+        print(f"🗂️  模板缓存: 命中率 {stats['hit_rate']:.0%}（命中 {stats['hits']}，"
+              f"未命中 {stats['misses']}），占用 {stats['bytes'] / 1024 / 1024:.0f}MB")
+    
+    def _render_cache_key(self, render_cache, image_path, text_content, render_options,
+                          layout_hint=None, output_format="jpeg"):
+        """计算增量渲染缓存的键，包含所有会影响输出图片的参数"""
+        position, font_size = self._resolve_layout(
+            image_path, None, render_options['font_size'], log=False, layout_hint=layout_hint,
+            default_position=render_options.get('default_position', 'top-left')
+        )
+        outline_color = render_options.get('outline_color')
+        auto_color = self.is_auto_color(render_options.get('color'))
+        render_params = {
+            'position': position,
+            'font_size': font_size,
+            'color': 'auto' if auto_color else self.parse_color(render_options.get('color', 'black')),
+            'outline_color': self.parse_color(outline_color) if outline_color else None,
+            # 自动颜色加的描边也使用 outline_width，这时即使没有描边颜色也要计入
+            'outline_width': render_options.get('outline_width', 0) if outline_color or auto_color else 0,
+            'render_mode': render_options.get('render_mode', 'fast'),
+            'jpeg_preset': render_options.get('jpeg_preset', 'fast'),
+        }
+        # fast 模式的行高和行宽改为按字体度量计算，旧的缓存结果不能再使用
+        if render_params['render_mode'] != 'legacy':
+            render_params['line_metrics'] = 'font'
+        # 非JPEG输出和编码参数只在指定时加入，不影响已有缓存的键（编码线程数不影响输出）
+        if output_format != 'jpeg':
+            render_params['output_format'] = output_format
+        for key in ('quality', 'effort'):
+            if render_options.get(key) is not None:
+                render_params[key] = render_options[key]
+        # 只在启用时加入排版参数，不影响已有缓存的键
+        if render_options.get('wrap') or render_options.get('fit'):
+            render_params['wrap'] = bool(render_options.get('wrap'))
+            render_params['fit'] = bool(render_options.get('fit'))
+            render_params['min_font_size'] = render_options.get('min_font_size', DEFAULT_MIN_FONT_SIZE)
+        font_path = self._resolve_font_path(render_options['font_name'])
+        return render_cache.compute_key(image_path, text_content, font_path, render_params)
+    
+    def _render_in_pool(self, tasks, render_options, jobs):
+        """在进程池中渲染，按任务顺序逐个产出 (输出路径或None, 错误信息)"""
+        # 每个工作进程启动时预加载本批次会用到的字体大小
+        font_sizes = {render_options['font_size']}
+        for image_path, _, _, layout_hint in tasks:
+            _, parsed_font_size = layout_hint or self.parse_position_and_size_from_filename(image_path)
+            if parsed_font_size is not None:
+                font_sizes.add(parsed_font_size)
+        
+        executor = self._get_render_pool(jobs, render_options['font_name'], sorted(font_sizes))
+        try:
+            worker_tasks = [task + (render_options,) for task in tasks]
+            for result, error, duration, overflow, timings in executor.map(_render_worker, worker_tasks):
+                # 合并工作进程中记录的各阶段耗时
+                self.timer.merge(timings)
+                yield result, error, duration, overflow
+        finally:
+            if not self.keep_render_pool:
+                self.close_render_pool()
+    
+    def submit_render_to_bytes(self, params, jobs):
+        """
+        把一次 render_to_bytes 交给进程池，返回 Future
+        
+        进程池会一直保留，直到调用 close_render_pool
+        """
+        executor = self.start_render_pool(jobs, params.get('font_name', 'arial'),
+                                          [params.get('font_size', 40)])
+        return executor.submit(_render_bytes_worker, params)
+    
+    def start_render_pool(self, jobs, font_name, font_sizes, warm=False):
+        """
+        启动（或复用）常驻进程池，进程池会一直保留，直到调用 close_render_pool
+        
+        warm=True 时等待所有工作进程启动并加载好字体，之后的第一个任务不再付出启动开销
+        """
+        self.keep_render_pool = True
+        executor = self._get_render_pool(jobs, font_name, font_sizes)
+        if warm:
+            # ProcessPoolExecutor 在提交任务时才启动工作进程，同时提交 jobs 个任务让所有进程都启动
+            for future in [executor.submit(_ping_worker) for _ in range(jobs)]:
+                future.result()
+        return executor
+    
+    def _get_render_pool(self, jobs, font_name, font_sizes):
+        """获取进程池，已启动的进程池进程数不少于 jobs 时直接复用（线程安全）"""
+        with self._render_pool_lock:
+            if self._render_pool is not None and self._render_pool_jobs >= jobs:
+                return self._render_pool
+            
+            self.close_render_pool()
+            # 工作进程使用与当前渲染器相同的缓存配置
+            adder_options = {
+                'template_cache_mb': self.template_cache.max_bytes / 1024 / 1024 if self.template_cache else 0,
+                'pixel_cache_dir': self.pixel_cache.cache_dir if self.pixel_cache else None,
+                'profile': self.timer.enabled,
+            }
+            self._render_pool = ProcessPoolExecutor(max_workers=jobs,
+                                                    initializer=_init_render_worker,
+                                                    initargs=(font_name, font_sizes, adder_options))
+            self._render_pool_jobs = jobs
+            return self._render_pool
+    
+    def close_render_pool(self):
+        """关闭进程池"""
+        with self._render_pool_lock:
+            if self._render_pool is not None:
+                self._render_pool.shutdown()
+                self._render_pool = None
+                self._render_pool_jobs = None
+    
+    def _extend_selection(self, previous, all_image_files, count):
+        """
+        沿用上次选中的模板，只为新增的段落和已被删除的模板随机补选
+
+        previous 为 RenderCache.get_selection 的结果，补选的模板不与沿用的模板重复
+        """
+        kept = [path for path in previous if path is not None]
+        missing = count - len(kept)
+        if missing == 0:
+            self._log(f"🎲 沿用上次选择的 {count} 张图片")
+            return list(previous)
+        used = set(kept)
+        fresh = iter(random.sample([path for path in all_image_files if path not in used], missing))
+        if kept:
+            self._log(f"🎲 沿用上次选择的 {len(kept)} 张图片，随机补选 {missing} 张")
+        else:
+            self._log(f"🎲 从 {len(all_image_files)} 张图片中随机选择了 {count} 张")
+        return [path if path is not None else next(fresh) for path in previous] + list(fresh)
+    
     def auto_process_images(self, folder_path, img_source_folder="D:\\cursor\\imgaddtext\\xiaoshani\\img", 
                            output_folder=None, font_name="simkai", font_size=40, 
-                           color="black", outline_color=None, outline_width=0):
+                           color="black", outline_color=None, outline_width=0,
+                           render_mode="fast", jpeg_preset="fast", jobs=1,
+                           pipeline=False, incremental=False, render_cache_dir=None,
+                           render_cache_size_mb=DEFAULT_CACHE_SIZE_MB, wrap=False, fit=False,
+                           min_font_size=DEFAULT_MIN_FONT_SIZE, position=None, output_format="jpeg",
+                           quality=None, effort=None, encode_threads=None):
         """
         自动处理图片，从指定文件夹的0.txt读取段落，随机选择对应数量的图片添加文字
         
@@ -621,8 +1804,26 @@ class ImageTextAdder:
         - color: 文字颜色
         - outline_color: 描边颜色
         - outline_width: 描边宽度
+        - render_mode: 渲染模式，fast 或 legacy
+        - jpeg_preset: JPEG编码预设，fast、balanced 或 small
+        - jobs: 并行渲染的进程数，1为单进程，0或None表示使用全部CPU核心
+        - pipeline: 单进程时使用解码/渲染/编码流水线，并报告各阶段利用率
+        - incremental: 增量模式，输入没有变化的输出图片不重新渲染
+        - render_cache_dir: 增量模式下保存渲染结果的缓存目录（可选）
+        - render_cache_size_mb: 缓存目录的大小上限（MB）
+        - wrap: 按可用宽度自动换行
+        - fit: 文字块放不下时自动缩小字号
+        - min_font_size: 自动缩小字号时的最小字号
+        - position: 为 auto 时，文件名中没有位置信息的模板自动选择画面最平坦的区域
+        - output_format: 输出格式，jpeg、png、webp 或 avif
+        - quality: 编码质量（jpeg、webp、avif）
+        - effort: 压缩力度（png、webp、avif），越大文件越小、编码越慢
+        - encode_threads: 编码线程数（只有avif支持）
         """
         
+        if not self.check_output_format(output_format, quality, effort, encode_threads):
+            return 0
+        
         # 检查0.txt文件是否存在
         text_file_path = os.path.join(folder_path, "0.txt")
         if not os.path.exists(text_file_path):
@@ -634,25 +1835,16 @@ class ImageTextAdder:
             print(f"❌ 图片源文件夹不存在: {img_source_folder}")
             return 0
         
-        # 解析文本段落
-        paragraphs = self.parse_text_paragraphs(text_file_path)
+        # 从模板索引获取图片源文件夹中的所有图片文件（按文件名排序）
+        template_index = self.get_template_index(img_source_folder)
+        all_image_files = [entry['path'] for entry in template_index.refresh()]
+        
+        # 逐段读取文本段落，最多用到模板数量个段落（多读一段用于判断是否还有剩余）
+        paragraphs, remaining = self._read_paragraphs(text_file_path, len(all_image_files) + 1)
         if not paragraphs:
             print("❌ 没有找到有效的文本段落")
             return 0
         
-        # 获取图片源文件夹中的所有图片文件
-        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif', '*.tiff']
-        all_image_files = []
-        
-        for ext in image_extensions:
-            pattern = os.path.join(img_source_folder, ext)
-            all_image_files.extend(glob.glob(pattern))
-            pattern = os.path.join(img_source_folder, ext.upper())
-            all_image_files.extend(glob.glob(pattern))
-        
-        # 去重
-        all_image_files = list(set(all_image_files))
-        
         # 根据段落数量选择图片数量
         needed_images = min(len(paragraphs), len(all_image_files))
         
@@ -664,10 +1856,6 @@ class ImageTextAdder:
             print(f"❌ 图片源文件夹中只有 {len(all_image_files)} 张图片，需要 {needed_images} 张")
             return 0
         
-        # 随机选择需要的图片数量
-        selected_images = random.sample(all_image_files, needed_images)
-        print(f"🎲 从 {len(all_image_files)} 张图片中随机选择了 {needed_images} 张")
-        
         # 设置输出文件夹
         if output_folder is None:
             output_folder = os.path.join(folder_path, "output")
@@ -675,53 +1863,211 @@ class ImageTextAdder:
         # 创建输出文件夹
         os.makedirs(output_folder, exist_ok=True)
         
+        render_cache = None
+        if incremental:
+            render_cache = RenderCache(output_folder, render_cache_dir, render_cache_size_mb)
+        
+        # 随机选择需要的图片数量
+        # 增量模式下沿用上次选中的模板，这样只有改动过的段落需要重新渲染
+        if render_cache:
+            selected_images = self._extend_selection(
+                render_cache.get_selection(needed_images, all_image_files), all_image_files, needed_images)
+            render_cache.set_selection(selected_images)
+        else:
+            selected_images = random.sample(all_image_files, needed_images)
+            self._log(f"🎲 从 {len(all_image_files)} 张图片中随机选择了 {needed_images} 张")
+        
         # 处理图片和文本的配对
-        processed_count = 0
         min_count = min(len(paragraphs), len(selected_images))
+        self.last_expected_count = min_count
         
-        print(f"\n🔄 开始自动处理，将处理 {min_count} 张图片...")
+        self._log(f"\n🔄 开始自动处理，将处理 {min_count} 张图片...")
         
-        for i in range(min_count):
-            image_path = selected_images[i]
-            text_content = paragraphs[i]
-            
-
-            # 生成输出文件名，添加数字前缀
-            image_name = os.path.splitext(os.path.basename(image_path))[0]
-            output_path = os.path.join(output_folder, f"{i+1}-{image_name}_text.jpg")
-            
-            print(f"\n📝 处理第 {i+1} 张图片: {os.path.basename(image_path)}")
-            print(f"   文本内容: {text_content[:30]}..." if len(text_content) > 30 else f"   文本内容: {text_content}")
-            
-            # 添加文字到图片（不传递position和font_size，让方法内部解析）
-            result = self.add_text_to_image(
-                image_path=image_path,
-                text=text_content,
-                output_path=output_path,
-                font_name=font_name,
-                font_size=font_size,
-                color=color,
-                position=None,  # 让方法内部从文件名解析
-                outline_color=outline_color,
-                outline_width=outline_width
-            )
-            
-            if result:
-                processed_count += 1
-                print(f"   ✅ 保存到: {output_path}")
-            else:
-                print(f"   ❌ 处理失败")
+        render_options = self._build_render_options(
+            font_name, font_size, color, outline_color, outline_width, render_mode, jpeg_preset,
+            wrap, fit, min_font_size, position,
+            quality=quality, effort=effort, encode_threads=encode_threads
+        )
+        processed_count = self._process_pairs(
+            list(zip(selected_images, paragraphs)), output_folder, render_options, jobs, pipeline,
+            render_cache, template_index.layout_hints(), output_format
+        )
         
-        print(f"\n🎉 自动处理完成！成功处理 {processed_count} 张图片")
-        print(f"📁 输出文件夹: {output_folder}")
+        self._log(f"\n🎉 自动处理完成！成功处理 {processed_count} 张图片")
+        self._log(f"📁 输出文件夹: {output_folder}")
         
         # 显示剩余内容统计
         if len(paragraphs) > len(selected_images):
-            print(f"⚠️  还有 {len(paragraphs) - len(selected_images)} 个文本段落没有处理")
+            unused = len(paragraphs) - len(selected_images) + sum(1 for _ in remaining)
+            print(f"⚠️  还有 {unused} 个文本段落没有处理")
         elif len(selected_images) > len(paragraphs):
             print(f"⚠️  还有 {len(selected_images) - len(paragraphs)} 张图片没有使用")
         
         return processed_count
+    
+    AUTO_STAMP_NAME = ".auto_done.json"
+    
+    def find_auto_folders(self, root_folder, img_source_folder=None):
+        """查找根目录下所有包含0.txt的文件夹（跳过隐藏目录、output目录和图片源文件夹）"""
+        skip_dirs = {os.path.abspath(img_source_folder)} if img_source_folder else set()
+        folders = []
+        for current, dirs, files in os.walk(root_folder):
+            dirs[:] = sorted(d for d in dirs
+                             if not d.startswith('.') and d != 'output'
+                             and os.path.abspath(os.path.join(current, d)) not in skip_dirs)
+            if "0.txt" in files:
+                folders.append(current)
+        return folders
+    
+    def _auto_stamp(self, folder_path, img_source_folder, options):
+        """计算一个文件夹的处理标记：0.txt内容、模板文件夹内容和处理参数"""
+        text_digest = hashlib.sha256()
+        with open(os.path.join(folder_path, "0.txt"), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                text_digest.update(chunk)
+        text_hash = text_digest.hexdigest()
+        templates = hashlib.sha256()
+        for entry in self.get_template_index(img_source_folder).entries():
+            templates.update(f"{entry['name']}:{entry['bytes']}:{entry['mtime']}\n".encode('utf-8'))
+        return {
+            'text': text_hash,
+            'templates': templates.hexdigest(),
+            'options': json.loads(json.dumps(
+                {key: value for key, value in options.items() if key not in AUTO_STAMP_IGNORED_OPTIONS},
+                sort_keys=True, default=str)),
+        }
+    
+    def _is_auto_output_current(self, output_folder, stamp):
+        """输出文件夹中的标记与当前输入一致，且输出图片数量足够"""
+        try:
+            with open(os.path.join(output_folder, self.AUTO_STAMP_NAME), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if {key: saved.get(key) for key in stamp} != stamp:
+            return False
+        outputs = [name for name in os.listdir(output_folder) if '_text.' in name]
+        return len(outputs) >= saved.get('count', 0)
+    
+    def auto_process_all(self, root_folder, img_source_folder="D:\\cursor\\imgaddtext\\xiaoshani\\img",
+                         output_folder=None, force=False, **options):
+        """
+        自动处理根目录下所有包含0.txt的文件夹
+        
+        所有文件夹共用同一个渲染器，字体缓存、模板索引、模板图片缓存和进程池只初始化一次。
+        输出已是最新（0.txt、模板和参数都没有变化）的文件夹会被跳过。
+        
+        参数:
+        - root_folder: 根目录
+        - img_source_folder: 图片源文件夹路径
+        - output_folder: 输出根目录（可选），每个文件夹输出到其中对应的相对路径；
+          默认输出到各文件夹自己的 output 目录
+        - force: 忽略处理标记，重新处理所有文件夹
+        - options: 传给 auto_process_images 的其它参数
+        """
+        if not os.path.isdir(root_folder):
+            print(f"❌ 根目录不存在: {root_folder}")
+            return 0
+        if not os.path.exists(img_source_folder):
+            print(f"❌ 图片源文件夹不存在: {img_source_folder}")
+            return 0
+        
+        folders = self.find_auto_folders(root_folder, img_source_folder)
+        if not folders:
+            print(f"❌ 在 {root_folder} 下没有找到包含0.txt的文件夹")
+            return 0
+        self._log(f"📂 找到 {len(folders)} 个包含0.txt的文件夹")
+        
+        # 先同步一次模板索引，之后各文件夹直接使用
+        self.get_template_index(img_source_folder).refresh()
+        
+        start = time.perf_counter()
+        total_images = 0
+        processed_folders = 0
+        skipped_folders = 0
+        keep_pool = self.keep_render_pool
+        self.keep_render_pool = True
+        try:
+            for i, folder in enumerate(folders, 1):
+                if output_folder:
+                    relative = os.path.relpath(folder, root_folder)
+                    folder_output = os.path.normpath(os.path.join(output_folder, relative))
+                else:
+                    folder_output = os.path.join(folder, "output")
+                
+                stamp = self._auto_stamp(folder, img_source_folder, options)
+                if not force and self._is_auto_output_current(folder_output, stamp):
+                    self._log(f"\n⏭️  [{i}/{len(folders)}] 输出已是最新，跳过: {folder}")
+                    skipped_folders += 1
+                    continue
+                
+                self._log(f"\n📁 [{i}/{len(folders)}] {folder}")
+                count = self.auto_process_images(folder, img_source_folder, folder_output, **options)
+                total_images += count
+                processed_folders += 1
+                
+                # 全部成功时才写入标记，下次运行时跳过
+                if count and count == self.last_expected_count:
+                    stamp['count'] = count
+                    try:
+                        with open(os.path.join(folder_output, self.AUTO_STAMP_NAME), 'w', encoding='utf-8') as f:
+                            json.dump(stamp, f, ensure_ascii=False, indent=2)
+                    except OSError as e:
+                        print(f"⚠️  保存处理标记失败: {e}")
+        finally:
+            self.keep_render_pool = keep_pool
+            if not keep_pool:
+                self.close_render_pool()
+        
+        elapsed = time.perf_counter() - start
+        rate = total_images / elapsed if elapsed > 0 else 0.0
+        self._log(f"\n🏁 全部完成：{len(folders)} 个文件夹，处理 {processed_folders} 个，跳过 {skipped_folders} 个")
+        self._log(f"🖼️  共生成 {total_images} 张图片，用时 {elapsed:.2f} 秒（{rate:.1f} 张/秒）")
+        return total_images
+
+
+# 进程池工作进程中使用的渲染器，每个进程只创建一次
+_worker_adder = None
+
+
+def _init_render_worker(font_name, font_sizes, adder_options=None):
+    """工作进程初始化：创建渲染器并预加载字体"""
+    global _worker_adder
+    _worker_adder = ImageTextAdder(verbose=False, **(adder_options or {}))
+    for font_size in font_sizes:
+        _worker_adder.get_font(font_name, font_size)
+
+
+def _render_worker(task):
+    """
+    在工作进程中渲染单张图片
+    
+    返回 (输出路径或None, 错误信息, 渲染和保存耗时（秒）, 超出可用区域信息, 本张图片的各阶段耗时)；
+    工作进程不输出信息，超出提示由主进程按顺序报告
+    """
+    image_path, text_content, output_path, layout_hint, render_options = task
+    started = time.perf_counter()
+    result = _worker_adder.add_text_to_image(
+        image_path=image_path,
+        text=text_content,
+        output_path=output_path,
+        position=None,
+        layout_hint=layout_hint,
+        **render_options
+    )
+    duration = time.perf_counter() - started
+    return (result, _worker_adder.last_error, duration, _worker_adder.last_overflow,
+            _worker_adder.timer.drain())
+
+
+def _ping_worker():
+    """空任务，用来提前启动工作进程"""
+    return os.getpid()
+
+
+def _render_bytes_worker(params):
+    """在工作进程中执行 render_to_bytes，返回编码后的图片数据"""
+    return _worker_adder.render_to_bytes(**params)
 
 def main():
     parser = argparse.ArgumentParser(description="给图片添加文字的工具")
@@ -730,11 +2076,26 @@ def main():
     parser.add_argument("-o", "--output", help="输出图片路径")
     parser.add_argument("-f", "--font", default="slidexiaxing", help="字体名称")
     parser.add_argument("-s", "--size", type=int, default=40, help="字体大小")
-    parser.add_argument("-c", "--color", default="black", help="文字颜色")
-    parser.add_argument("-p", "--position", default=None, help="文字位置")
+    parser.add_argument("-c", "--color", default="black", help="文字颜色；auto 表示按背景亮度自动选择（需要时自动加描边）")
+    parser.add_argument("-p", "--position", default=None,
+                        help="文字位置；auto 表示自动选择画面最平坦的区域（批量和自动模式下用于文件名中没有位置信息的图片）")
     parser.add_argument("--outline-color", help="描边颜色")
     parser.add_argument("--outline-width", type=int, default=0, help="描边宽度")
+    parser.add_argument("--render-mode", choices=RENDER_MODES, default="fast",
+                        help="渲染模式：fast 蒙版渲染（默认），legacy 多次重绘（兼容旧输出）")
+    parser.add_argument("--jpeg-preset", choices=list(JPEG_PRESETS), default="fast",
+                        help="JPEG编码预设：fast 编码最快（默认），balanced 均衡，small 文件最小")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default=None,
+                        help="输出格式：jpeg（批量和自动处理的默认值）、png、webp、avif")
+    parser.add_argument("--quality", type=int, default=None, help="编码质量（jpeg、webp、avif），默认使用编码器默认值")
+    parser.add_argument("--effort", type=int, default=None,
+                        help="压缩力度，越大文件越小、编码越慢（png 0-9，webp 0-6，avif 0-10）")
+    parser.add_argument("--encode-threads", type=int, default=None, help="编码线程数（只有avif支持，默认使用全部CPU核心）")
+    parser.add_argument("--wrap", action="store_true", help="按可用宽度自动换行")
+    parser.add_argument("--fit", action="store_true", help="文字放不下时自动缩小字号（同时自动换行）")
+    parser.add_argument("--min-size", type=int, default=DEFAULT_MIN_FONT_SIZE, help="自动缩小字号时的最小字号")
     parser.add_argument("--list-fonts", action="store_true", help="列出可用字体")
+    parser.add_argument("--refresh-fonts", action="store_true", help="忽略字体注册表，重新探测可用字体")
     parser.add_argument("--show-colors", action="store_true", help="显示颜色示例")
     parser.add_argument("--show-positions", action="store_true", help="显示位置示例")
     
@@ -743,15 +2104,64 @@ def main():
     parser.add_argument("--folder", help="图片文件夹路径（批量处理时使用）")
     parser.add_argument("--text-file", help="文本文件路径（批量处理时使用）")
     parser.add_argument("--output-folder", help="输出文件夹路径（批量处理时使用）")
+    parser.add_argument("--pipeline", action="store_true", help="单进程时使用解码/渲染/编码流水线，并报告各阶段利用率")
+    parser.add_argument("--incremental", action="store_true", help="增量模式：输入没有变化的图片不重新渲染")
+    parser.add_argument("--render-cache", help="增量模式下保存渲染结果的缓存目录")
+    parser.add_argument("--render-cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB, help="渲染缓存目录的大小上限（MB）")
+    parser.add_argument("--template-cache-mb", type=int, default=None,
+                        help=f"在内存中缓存已解码模板图片的大小上限（MB），0表示不缓存；默认不缓存，渲染服务模式默认{SERVE_TEMPLATE_CACHE_MB}MB")
+    parser.add_argument("--pixel-cache", help="磁盘像素缓存目录：保存模板解码后的像素，之后直接内存映射读取，不再解码")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并行渲染的进程数（批量/自动处理时使用），0表示使用全部CPU核心")
     
     # 自动处理参数
     parser.add_argument("--auto", help="自动处理模式，从指定文件夹的0.txt读取段落，随机选择对应数量的图片")
+    parser.add_argument("--auto-all", help="自动处理指定根目录下所有包含0.txt的文件夹")
+    parser.add_argument("--force", action="store_true", help="与 --auto-all 一起使用：输出已是最新的文件夹也重新处理")
+
+    parser.add_argument("-q", "--quiet", action="store_true", help="安静模式：不输出每张图片的处理信息，只输出错误")
+    parser.add_argument("--events", help="把每张图片的处理结果写入JSON Lines文件（同时启用安静模式）")
+    parser.add_argument("--profile", help="记录各阶段（解码、字体、测量、绘制、合成、转换、保存）耗时并保存为JSON")
+    parser.add_argument("--cprofile", help="用cProfile记录整个运行过程，保存为pstats文件")
+    parser.add_argument("--serve", help="启动渲染服务，监听 host:port 或 unix:/path，保持字体和模板缓存常驻")
 
     parser.add_argument("--img-source", default="./xiaoshani/img", help="图片源文件夹路径（自动处理时使用）")
     
     args = parser.parse_args()
     
-    adder = ImageTextAdder()
+    # 渲染服务常驻运行，同一批模板会被反复使用，默认开启模板缓存
+    if args.template_cache_mb is None:
+        args.template_cache_mb = SERVE_TEMPLATE_CACHE_MB if args.serve else 0
+    adder = ImageTextAdder(template_cache_mb=args.template_cache_mb,
+                           pixel_cache_dir=args.pixel_cache,
+                           profile=bool(args.profile),
+                           verbose=not (args.quiet or args.events))
+    if args.events:
+        adder.events = EventLog(args.events)
+    
+    profiler = None
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return run_command(adder, args, parser)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"\n📈 cProfile 结果已保存: {args.cprofile}（累计耗时前{PROFILE_TOP_FUNCTIONS}的函数如下）")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        if adder.events is not None:
+            adder.events.close()
+        if args.profile:
+            adder.timer.print_report()
+            adder.timer.save(args.profile)
+            print(f"💾 阶段耗时已保存: {args.profile}")
+
+
+def run_command(adder, args, parser):
+    """执行命令行指定的操作，单张图片处理失败时返回1"""
+    if args.refresh_fonts:
+        adder.refresh_fonts()
     
     if args.list_fonts:
         adder.list_available_fonts()
@@ -765,6 +2175,36 @@ def main():
         adder.show_position_examples()
         return
     
+    # 渲染服务模式
+    if args.serve:
+        # 只有服务模式才需要 http.server，普通命令行运行不导入
+        from render_server import RenderServer
+        # 预热字体和模板缓存，之后的请求不再付出首次加载的开销
+        adder.get_font(args.font, args.size)
+        server = RenderServer(adder, args.serve, jobs=args.jobs, defaults=dict(
+            font_name=args.font,
+            font_size=args.size,
+            color=args.color,
+            position=args.position,
+            outline_color=args.outline_color,
+            outline_width=args.outline_width,
+            render_mode=args.render_mode,
+            jpeg_preset=args.jpeg_preset,
+            wrap=args.wrap or args.fit,
+            fit=args.fit,
+            min_font_size=args.min_size,
+            quality=args.quality,
+            effort=args.effort,
+            encode_threads=args.encode_threads
+        ))
+        server.serve_forever()
+        return
+    
+    # 批量和自动处理之前先检查输出格式和编码参数，避免渲染完全部图片后才在编码时失败
+    if (args.batch or args.auto or args.auto_all) and not adder.check_output_format(
+            args.format or "jpeg", args.quality, args.effort, args.encode_threads):
+        return 1
+    
     # 批量处理模式
     if args.batch:
         if not args.folder or not args.text_file:
@@ -790,13 +2230,66 @@ def main():
             color=args.color,
             position=args.position,
             outline_color=args.outline_color,
-            outline_width=args.outline_width
+            outline_width=args.outline_width,
+            render_mode=args.render_mode,
+            jpeg_preset=args.jpeg_preset,
+            jobs=args.jobs,
+            pipeline=args.pipeline,
+            incremental=args.incremental or bool(args.render_cache),
+            render_cache_dir=args.render_cache,
+            render_cache_size_mb=args.render_cache_size,
+            wrap=args.wrap or args.fit,
+            fit=args.fit,
+            min_font_size=args.min_size,
+            output_format=args.format or "jpeg",
+            quality=args.quality,
+            effort=args.effort,
+            encode_threads=args.encode_threads
         )
         
-        if result:
+        if result and adder.verbose:
             print(f"\n🎉 批量处理成功完成！共处理 {result} 张图片")
         return
     
+    auto_options = dict(
+        font_name=args.font,
+        font_size=args.size,
+        color=args.color,
+        outline_color=args.outline_color,
+        outline_width=args.outline_width,
+        render_mode=args.render_mode,
+        jpeg_preset=args.jpeg_preset,
+        jobs=args.jobs,
+        pipeline=args.pipeline,
+        incremental=args.incremental or bool(args.render_cache),
+        render_cache_dir=args.render_cache,
+        render_cache_size_mb=args.render_cache_size,
+        wrap=args.wrap or args.fit,
+        fit=args.fit,
+        min_font_size=args.min_size
+    )
+    if args.position:
+        auto_options['position'] = args.position
+    if args.format:
+        auto_options['output_format'] = args.format
+    for key in ENCODE_OPTIONS:
+        if getattr(args, key) is not None:
+            auto_options[key] = getattr(args, key)
+    
+    # 多文件夹自动处理模式
+    if args.auto_all:
+        result = adder.auto_process_all(
+            root_folder=args.auto_all,
+            img_source_folder=args.img_source,
+            output_folder=args.output_folder,
+            force=args.force,
+            **auto_options
+        )
+        
+        if result and adder.verbose:
+            print(f"\n🎉 多文件夹自动处理完成！共处理 {result} 张图片")
+        return
+    
     # 自动处理模式
     if args.auto:
         if not os.path.exists(args.auto):
@@ -808,14 +2301,10 @@ def main():
             folder_path=args.auto,
             img_source_folder=args.img_source,
             output_folder=args.output_folder,
-            font_name=args.font,
-            font_size=args.size,
-            color=args.color,
-            outline_color=args.outline_color,
-            outline_width=args.outline_width
+            **auto_options
         )
         
-        if result:
+        if result and adder.verbose:
             print(f"\n🎉 自动处理成功完成！共处理 {result} 张图片")
         return
     
@@ -827,23 +2316,59 @@ def main():
     # 检查输入文件是否存在
     if not os.path.exists(args.image):
         print(f"❌ 错误: 图片文件不存在: {args.image}")
-        return
+        return 1
+    
+    # 指定了 --format 而没有指定输出文件时，按格式决定输出文件的扩展名
+    output_path = args.output
+    if args.format:
+        if not adder.check_output_format(args.format):
+            return 1
+        image_format, format_ext = OUTPUT_FORMATS[args.format]
+        if output_path is None:
+            output_path = f"{os.path.splitext(args.image)[0]}_with_text{format_ext}"
+        elif Image.registered_extensions().get(os.path.splitext(output_path)[1].lower()) != image_format:
+            # 输出格式由扩展名决定，两者不一致时不猜测用户的意图
+            print(f"❌ 错误: 输出文件 {output_path} 的扩展名与 --format {args.format} 不一致，"
+                  f"请使用 {format_ext} 扩展名或去掉 --format")
+            return 1
+    
+    # 输出格式由输出文件的扩展名决定（没有指定时与输入图片相同）
+    output_ext = os.path.splitext(output_path or args.image)[1].lower()
+    if not adder.check_encode_options(Image.registered_extensions().get(output_ext),
+                                      args.quality, args.effort, args.encode_threads):
+        return 1
     
     # 添加文字
     result = adder.add_text_to_image(
         image_path=args.image,
         text=args.text,
-        output_path=args.output,
+        output_path=output_path,
         font_name=args.font,
         font_size=args.size,
         color=args.color,
         position=args.position,
         outline_color=args.outline_color,
-        outline_width=args.outline_width
+        outline_width=args.outline_width,
+        render_mode=args.render_mode,
+        jpeg_preset=args.jpeg_preset,
+        wrap=args.wrap or args.fit,
+        fit=args.fit,
+        min_font_size=args.min_size,
+        quality=args.quality,
+        effort=args.effort,
+        encode_threads=args.encode_threads
     )
     
     if result:
+        # 安静模式下 add_text_to_image 不输出超出提示，这里补上
+        if adder.last_overflow and not adder.verbose:
+            print(adder.overflow_message(adder.last_overflow))
         print(f"🎉 处理完成! 输出文件: {result}")
+        return 0
+    # 安静模式下 add_text_to_image 不输出错误，这里补上
+    if not adder.verbose:
+        print(f"❌ 错误: {adder.last_error}")
+    return 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
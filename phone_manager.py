@@ -15,6 +15,7 @@ import argparse
 import subprocess
 from pathlib import Path
 import re
+from image_discovery import list_images, has_image_extension
 
 class PhoneManager:
     def __init__(self):
@@ -25,17 +26,12 @@ class PhoneManager:
         return re.match(r'^\d+$', folder_name) is not None or folder_name == "output" or folder_name == "xiaoshani"
     
     def get_image_files(self, folder_path):
-        """获取文件夹中的所有图片文件"""
+        """获取文件夹中的所有图片文件，按文件名自然顺序排序"""
         if not os.path.exists(folder_path):
             print(f"❌ 文件夹不存在: {folder_path}")
             return []
         
-        image_files = []
-        for file in os.listdir(folder_path):
-            if any(file.lower().endswith(ext) for ext in self.supported_image_extensions):
-                image_files.append(os.path.join(folder_path, file))
-        
-        return image_files
+        return list_images(folder_path, self.supported_image_extensions)
     
     def check_adb_connection(self):
         """检查ADB连接状态"""
@@ -171,7 +167,7 @@ class PhoneManager:
             
             # 获取文件夹中的文件列表
             files = result.stdout.strip().split('\n')
-            image_files = [f for f in files if any(f.lower().endswith(ext) for ext in self.supported_image_extensions)]
+            image_files = [f for f in files if has_image_extension(f, self.supported_image_extensions)]
             
             if not image_files:
                 print(f"❌ 文件夹中没有图片文件: {folder_name}")
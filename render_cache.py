@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量渲染缓存
+功能：
+1. 根据模板图片内容、段落文字、字体和各项渲染参数计算每张输出图片的键
+2. 在输出文件夹中用清单文件记录每个输出文件对应的键，键不变时跳过渲染
+3. 可选的本地缓存目录，按键保存渲染结果，按总大小淘汰最久未使用的文件
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+# 渲染逻辑有不兼容变化时修改这个版本号，使旧的缓存全部失效
+RENDER_CACHE_VERSION = 1
+
+# 缓存目录默认大小上限（MB）
+DEFAULT_CACHE_SIZE_MB = 512
+
+
+class RenderCache:
+    MANIFEST_NAME = ".render_manifest.json"
+
+    def __init__(self, output_folder, cache_dir=None, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.output_folder = output_folder
+        self.manifest_path = os.path.join(output_folder, self.MANIFEST_NAME)
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.skipped = 0
+        self.copied = 0
+        self.rendered = 0
+        self._manifest = self._load_manifest()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _load_manifest(self):
+        """读取清单文件，不存在或损坏时返回空清单"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == RENDER_CACHE_VERSION:
+                return manifest
+        except (OSError, ValueError):
+            pass
+        return {'version': RENDER_CACHE_VERSION, 'outputs': {}, 'sources': {}}
+
+    def save(self):
+        """保存清单文件"""
+        tmp_path = self.manifest_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            print(f"⚠️  保存渲染清单失败: {e}")
+
+    def file_hash(self, path):
+        """
+        计算文件内容的哈希
+
+        按 (大小, 修改时间) 记在清单里，文件没有变化时不会重复读取
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        sources = self._manifest['sources']
+        entry = sources.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()
+        sources[path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        return file_hash
+
+    def compute_key(self, image_path, text, font_path, render_params):
+        """
+        计算一张输出图片的键
+
+        参数:
+        - image_path: 模板图片路径
+        - text: 段落文字
+        - font_path: 实际使用的字体文件路径（系统字体时为字体名称）
+        - render_params: 影响输出的其它参数（字体大小、颜色、描边、位置等）
+        """
+        font_id = self.file_hash(font_path) if os.path.isfile(font_path) else font_path
+        payload = json.dumps({
+            'version': RENDER_CACHE_VERSION,
+            'template': self.file_hash(image_path),
+            'text': text,
+            'font': font_id,
+            'params': render_params,
+        }, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_selection(self, count, available=None):
+        """
+        返回上次自动处理时选中的模板图片（最多 count 张，保持原来的顺序）
+
+        已被删除（或不在 available 中）的模板对应位置为None；记录的数量不够时返回的列表较短，
+        由调用方补选缺少的模板
+        """
+        selection = (self._manifest.get('selection') or [])[:count]
+        if available is None:
+            return [path if os.path.exists(path) else None for path in selection]
+        available = set(available)
+        return [path if path in available else None for path in selection]
+
+    def set_selection(self, image_paths):
+        """记录自动处理时选中的模板图片"""
+        self._manifest['selection'] = list(image_paths)
+
+    def is_current(self, output_path, key):
+        """输出文件存在且清单中记录的键相同"""
+        name = os.path.basename(output_path)
+        return self._manifest['outputs'].get(name) == key and os.path.exists(output_path)
+
+    def _cache_path(self, key, output_path):
+        return os.path.join(self.cache_dir, key + os.path.splitext(output_path)[1].lower())
+
+    def restore(self, output_path, key):
+        """从缓存目录复制已渲染的结果，成功时返回True"""
+        if not self.cache_dir:
+            return False
+        cache_path = self._cache_path(key, output_path)
+        if not os.path.exists(cache_path):
+            return False
+        try:
+            shutil.copyfile(cache_path, output_path)
+            # 更新访问时间，淘汰时按最近使用排序
+            os.utime(cache_path)
+        except OSError:
+            return False
+        self.record(output_path, key)
+        return True
+
+    def record(self, output_path, key):
+        """在清单中记录输出文件对应的键"""
+        self._manifest['outputs'][os.path.basename(output_path)] = key
+
+    def store(self, output_path, key):
+        """记录新渲染的输出，并复制一份到缓存目录"""
+        self.record(output_path, key)
+        if not self.cache_dir:
+            return
+        try:
+            shutil.copyfile(output_path, self._cache_path(key, output_path))
+        except OSError as e:
+            print(f"⚠️  写入渲染缓存失败: {e}")
+
+    def evict(self):
+        """缓存目录超过大小上限时，删除最久未使用的文件"""
+        if not self.cache_dir:
+            return 0
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                continue
+        return removed
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地渲染服务
+功能：
+1. 常驻进程中保持已预热的 ImageTextAdder（字体缓存、模板索引、模板图片缓存）
+2. 通过 HTTP（TCP 或 Unix 套接字）接收渲染请求，参数与 add_text_to_image 相同，直接返回编码后的图片
+3. 并发请求交给工作进程池渲染；/metrics 返回请求数、耗时分布和缓存统计
+
+接口：
+- POST /render  请求体为JSON，必须包含 image_path 和 text，其它字段与 add_text_to_image 的参数同名，
+  另外可以用 format 指定输出格式（JPEG、PNG、WEBP、AVIF 等）；成功时返回图片数据，失败时返回 {"error": ...}
+- GET /metrics  返回JSON格式的统计信息
+"""
+
+import os
+import json
+import time
+import signal
+import threading
+import socketserver
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from stage_timer import percentile
+
+# 请求体大小上限，渲染请求只包含参数，不需要很大
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# 计算耗时分位数时保留的最近请求数
+LATENCY_WINDOW = 1000
+
+# 允许在请求中指定的渲染参数
+RENDER_PARAMS = ('font_name', 'font_size', 'color', 'position', 'outline_color',
+                 'outline_width', 'render_mode', 'jpeg_preset', 'layout_hint',
+                 'wrap', 'fit', 'min_font_size', 'default_position',
+                 'quality', 'effort', 'encode_threads')
+
+# 必须是整数的渲染参数及其最小值（编码参数的上限按输出格式检查）
+INT_PARAMS = {
+    'font_size': 1,
+    'min_font_size': 1,
+    'outline_width': 0,
+    'quality': 0,
+    'effort': 0,
+    'encode_threads': 1,
+}
+
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp',
+    'TIFF': 'image/tiff',
+}
+
+
+def parse_address(address):
+    """
+    解析监听地址
+
+    支持 host:port、:port（监听127.0.0.1）和 unix:/path/to/socket，
+    返回 ('tcp', (host, port)) 或 ('unix', path)
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if not path:
+            raise ValueError("Unix套接字路径不能为空")
+        return 'unix', path
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise ValueError(f"无效的监听地址: {address}，格式应为 host:port 或 unix:/path")
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听Unix套接字的多线程HTTP服务"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        # 删除上次运行留下的套接字文件
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class RenderMetrics:
+    """渲染服务的统计信息，线程安全"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.bytes_out = 0
+        self.render_seconds = 0.0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, elapsed, nbytes=0, error=False):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            if error:
+                self.errors += 1
+            else:
+                self.bytes_out += nbytes
+                self.render_seconds += elapsed
+                self._latencies.append(elapsed)
+
+    def snapshot(self):
+        """返回当前统计，耗时单位为毫秒"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            succeeded = self.requests - self.errors
+            return {
+                'uptime_seconds': round(time.time() - self.started, 3),
+                'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'bytes_out': self.bytes_out,
+                'latency_ms': {
+                    'mean': round(self.render_seconds / succeeded * 1000, 3) if succeeded else 0.0,
+                    'p50': round(percentile(latencies, 0.50) * 1000, 3),
+                    'p95': round(percentile(latencies, 0.95) * 1000, 3),
+                    'p99': round(percentile(latencies, 0.99) * 1000, 3),
+                },
+            }
+
+
+class RenderServer:
+    def __init__(self, adder, address, jobs=1, defaults=None):
+        """
+        参数:
+        - adder: 已创建的 ImageTextAdder，单进程渲染和统计缓存时使用
+        - address: 监听地址，host:port 或 unix:/path
+        - jobs: 渲染进程数，1表示在服务进程内渲染，0或None表示使用全部CPU核心
+        - defaults: 请求中没有提供的渲染参数的默认值
+        """
+        self.adder = adder
+        self.address = address
+        self.jobs = jobs if jobs else (os.cpu_count() or 1)
+        self.defaults = dict(defaults or {})
+        self.metrics = RenderMetrics()
+        # 同一个渲染器的字体对象不能被多个线程同时使用，单进程渲染时逐个处理
+        self._render_lock = threading.Lock()
+        self._server = self._create_server(address)
+        if self.jobs > 1:
+            # 启动服务前先启动所有工作进程并预加载字体，第一个请求不再等待进程启动
+            self.adder.start_render_pool(self.jobs, self.defaults.get('font_name', 'arial'),
+                                         [self.defaults.get('font_size', 40)], warm=True)
+
+    def _create_server(self, address):
+        kind, bind_address = parse_address(address)
+        handler = self._make_handler()
+        if kind == 'unix':
+            return UnixHTTPServer(bind_address, handler)
+        server = ThreadingHTTPServer(bind_address, handler)
+        server.daemon_threads = True
+        return server
+
+    def _make_handler(self):
+        render_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if self.path.split('?', 1)[0] == '/metrics':
+                    self._send_json(200, render_server.metrics_snapshot())
+                else:
+                    self._send_json(404, {'error': f"未知的路径: {self.path}"})
+
+            def do_POST(self):
+                if self.path.split('?', 1)[0] != '/render':
+                    self._send_json(404, {'error': f"未知的路径: {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    if length <= 0 or length > MAX_REQUEST_BYTES:
+                        raise ValueError("请求体为空或过大")
+                    request = json.loads(self.rfile.read(length).decode('utf-8'))
+                    if not isinstance(request, dict):
+                        raise ValueError("请求体必须是JSON对象")
+                except (ValueError, UnicodeDecodeError) as e:
+                    self._send_json(400, {'error': f"无效的请求: {e}"})
+                    return
+
+                status, image_format, payload = render_server.handle_render(request)
+                if status != 200:
+                    self._send_json(status, {'error': payload})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPES.get(image_format, 'application/octet-stream'))
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_json(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 每个请求都打印会拖慢服务，只在 verbose 时输出
+                if render_server.adder.verbose:
+                    print(f"🌐 {format % args}")
+
+        return Handler
+
+    def _build_params(self, request):
+        """合并请求参数和默认参数，返回 (参数, 输出格式)"""
+        image_path = request.get('image_path')
+        text = request.get('text')
+        if not image_path or text is None:
+            raise ValueError("缺少 image_path 或 text 参数")
+        if not os.path.isfile(image_path):
+            raise ValueError(f"图片文件不存在: {image_path}")
+
+        params = {key: value for key, value in self.defaults.items() if key in RENDER_PARAMS}
+        for key in RENDER_PARAMS:
+            if key in request:
+                params[key] = request[key]
+        for key, minimum in INT_PARAMS.items():
+            value = params.get(key)
+            if value is None:
+                continue
+            # bool 是 int 的子类，true/false 不能当作数字
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f"{key} 必须是整数: {value!r}")
+            if value < minimum:
+                raise ValueError(f"{key} 不能小于 {minimum}: {value}")
+        if params.get('layout_hint') is not None:
+            position, font_size = params['layout_hint']
+            params['layout_hint'] = (tuple(position) if position else None, font_size)
+
+        image_format = request.get('format')
+        if image_format is None:
+            # 与 render_to_bytes 相同：默认与输入图片的格式一致，无法识别时使用PNG
+            ext = os.path.splitext(image_path)[1].lower()
+            image_format = Image.registered_extensions().get(ext) or 'PNG'
+        if not isinstance(image_format, str):
+            raise ValueError(f"format 必须是字符串: {image_format!r}")
+        image_format = image_format.upper()
+        if image_format == 'JPG':
+            image_format = 'JPEG'
+        # 质量、压缩力度按输出格式检查范围
+        self.adder._encoder_params(image_format, params.get('jpeg_preset', 'fast'),
+                                   params.get('quality'), params.get('effort'),
+                                   params.get('encode_threads'))
+
+        params.update(image=image_path, text=text, image_format=image_format)
+        return params, image_format
+
+    def handle_render(self, request):
+        """处理一个渲染请求，返回 (HTTP状态码, 输出格式, 图片数据或错误信息)"""
+        try:
+            params, image_format = self._build_params(request)
+        except (ValueError, TypeError) as e:
+            return 400, None, str(e)
+
+        self.metrics.begin()
+        start = time.perf_counter()
+        try:
+            if self.jobs > 1:
+                data = self.adder.submit_render_to_bytes(params, self.jobs).result()
+            else:
+                with self._render_lock:
+                    data = self.adder.render_to_bytes(**params)
+        except Exception as e:
+            self.metrics.end(time.perf_counter() - start, error=True)
+            return 500, None, str(e)
+        self.metrics.end(time.perf_counter() - start, len(data))
+        return 200, image_format, data
+
+    def metrics_snapshot(self):
+        """服务统计，加上服务进程内的字体和模板缓存统计"""
+        snapshot = self.metrics.snapshot()
+        snapshot['jobs'] = self.jobs
+        snapshot['font_cache'] = self.adder.font_cache.stats()
+        if self.adder.template_cache is not None:
+            snapshot['template_cache'] = self.adder.template_cache.stats()
+        if self.adder.pixel_cache is not None:
+            snapshot['pixel_cache'] = self.adder.pixel_cache.stats()
+        return snapshot
+
+    def serve_forever(self):
+        """启动服务，按 Ctrl+C 停止"""
+        print(f"🚀 渲染服务已启动: {self.address}（渲染进程数: {self.jobs}）")
+        print("   POST /render 渲染图片，GET /metrics 查看统计")
+        # 收到 SIGTERM 时与 Ctrl+C 一样正常退出，清理套接字文件和进程池
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n👋 渲染服务已停止")
+        finally:
+            self.shutdown()
+
+    def _handle_sigterm(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def shutdown(self):
+        """关闭监听套接字和进程池"""
+        self._server.server_close()
+        self.adder.close_render_pool()
+        kind, bind_address = parse_address(self.address)
+        if kind == 'unix' and os.path.exists(bind_address):
+            os.remove(bind_address)
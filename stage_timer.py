@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分阶段计时
+功能：
+1. 在渲染热路径上记录各阶段（解码、字体、测量、绘制、合成、模式转换、保存）的耗时
+2. 默认关闭，关闭时每个阶段只多一次方法调用和一次判断
+3. 汇总每个阶段的总耗时、次数和分位数，可以保存为JSON
+4. 工作进程中的计时可以用 drain 取出，再在主进程中用 merge 合并
+
+用法:
+    t = timer.start()
+    ...  # 阶段1
+    t = timer.stop('open', t)
+    ...  # 阶段2
+    timer.stop('save', t)
+"""
+
+import json
+import math
+import threading
+from time import perf_counter
+
+# 报告中阶段的显示顺序，其它阶段排在后面
+STAGE_ORDER = ('open', 'font', 'measure', 'draw', 'composite', 'convert', 'save', 'image', 'batch')
+
+
+def percentile(sorted_values, p):
+    """
+    已排序列表的分位数（最近秩法：第 ceil(p*n) 个值），列表为空时返回0
+
+    --profile 报告、benchmark.py 和渲染服务的 /metrics 都使用这个函数，同样的数据得到同样的结果
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p * len(sorted_values)) - 1))]
+
+
+class StageTimer:
+    __slots__ = ('enabled', '_durations', '_lock')
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """返回开始时间，关闭时返回0"""
+        return perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage, started):
+        """记录从 started 到现在的耗时，返回当前时间（作为下一阶段的开始时间）"""
+        if not self.enabled:
+            return 0.0
+        now = perf_counter()
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = self._durations[stage] = []
+            durations.append(now - started)
+        return now
+
+    def add(self, stage, seconds):
+        """直接记录一段耗时"""
+        if self.enabled:
+            with self._lock:
+                self._durations.setdefault(stage, []).append(seconds)
+
+    def drain(self):
+        """取出并清空已记录的耗时，返回 {阶段: [秒, ...]}（关闭时为空字典）"""
+        with self._lock:
+            durations, self._durations = self._durations, {}
+        return durations
+
+    def merge(self, durations):
+        """合并 drain 取出的耗时"""
+        if self.enabled and durations:
+            with self._lock:
+                for stage, values in durations.items():
+                    self._durations.setdefault(stage, []).extend(values)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+
+    def report(self):
+        """各阶段的总耗时、次数、平均值和分位数（毫秒）"""
+        with self._lock:
+            items = {stage: sorted(durations) for stage, durations in self._durations.items()}
+
+        order = {stage: i for i, stage in enumerate(STAGE_ORDER)}
+        report = {}
+        for stage in sorted(items, key=lambda s: (order.get(s, len(order)), s)):
+            durations = items[stage]
+            total = sum(durations)
+            report[stage] = {
+                'count': len(durations),
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total / len(durations) * 1000, 3),
+                'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+                'p90_ms': round(percentile(durations, 0.90) * 1000, 3),
+                'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+                'max_ms': round(durations[-1] * 1000, 3),
+            }
+        return report
+
+    def save(self, path):
+        """把报告保存为JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.report()}, f, ensure_ascii=False, indent=2)
+
+    def print_report(self):
+        """在终端打印各阶段耗时"""
+        report = self.report()
+        if not report:
+            print("⏱️  没有记录到阶段耗时")
+            return
+        print("\n⏱️  各阶段耗时:")
+        print(f"   {'阶段':<10}{'次数':>8}{'总计ms':>12}{'平均ms':>10}{'p50ms':>10}{'p90ms':>10}{'p99ms':>10}")
+        for stage, stats in report.items():
+            print(f"   {stage:<10}{stats['count']:>8}{stats['total_ms']:>12.1f}{stats['mean_ms']:>10.2f}"
+                  f"{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
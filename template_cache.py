@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板图片缓存
+功能：
+1. 在内存中按 (路径, 修改时间) 缓存已解码的模板图片，按字节预算做LRU淘汰
+2. 渲染时使用缓存图片的副本，同一张模板不会被重复解码
+3. 可选的磁盘像素缓存：把解码后的像素按源文件哈希保存为带文件头的原始数据，
+   之后通过内存映射读取，多次运行和多个工作进程之间共享缓存文件，不需要再解码；
+   每次读取仍会在进程内复制一份完整的像素用于绘制
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def image_nbytes(image):
+    """估算解码后图片占用的内存字节数"""
+    return image.width * image.height * len(image.getbands())
+
+
+class TemplateCache:
+    """已解码模板图片的LRU缓存，按字节数限制总大小，线程安全"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_path, loader=None):
+        """
+        返回模板图片的副本（可以直接在上面绘制）
+
+        未命中时调用 loader(image_path) 解码，默认使用 Image.open
+        """
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image.copy()
+            self.misses += 1
+
+        # 在锁外解码，不阻塞其它线程读取缓存
+        image = loader(image_path) if loader else self._decode(image_path)
+        self._put(key, image)
+        return image.copy()
+
+    def _decode(self, image_path):
+        image = Image.open(image_path)
+        image.load()
+        return image
+
+    def _put(self, key, image):
+        nbytes = image_nbytes(image)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                return
+            self._images[key] = image
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.current_bytes -= image_nbytes(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._images.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'images': len(self._images),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+# 磁盘像素缓存文件头：魔数、宽、高、模式，补齐到32字节
+PIXEL_CACHE_MAGIC = b'IATPIX01'
+PIXEL_CACHE_HEADER = struct.Struct('<8sII4s12x')
+
+# 可以直接按原始数据保存的图片模式
+PIXEL_CACHE_MODES = ('RGB', 'RGBA', 'L')
+
+# 磁盘像素缓存默认大小上限（MB）
+DEFAULT_PIXEL_CACHE_MB = 4096
+
+
+class PixelCache:
+    """
+    磁盘上的解码像素缓存
+
+    每张模板对应一个 <源文件sha256>.raw 文件，源文件内容变化后哈希随之变化，
+    旧的缓存文件不再被使用，最终按大小上限被淘汰
+
+    省下的是JPEG解码的时间，不是内存：映射的页面只读，而文字要画在整张图片上并整张编码，
+    所以每次读取都会复制一份完整的像素（一次顺序内存复制，比解码快得多）
+    """
+
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_PIXEL_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def source_hash(self, image_path):
+        """源文件内容的哈希，同一进程内按 (大小, 修改时间) 记住结果"""
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        source_hash = self._hashes.get(key)
+        if source_hash is None:
+            digest = hashlib.sha256()
+            with open(image_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            source_hash = digest.hexdigest()
+            self._hashes[key] = source_hash
+        return source_hash
+
+    def load(self, image_path):
+        """返回解码后的图片（可以直接在上面绘制），优先使用磁盘缓存"""
+        raw_path = os.path.join(self.cache_dir, self.source_hash(image_path) + '.raw')
+        image = self._read(raw_path)
+        if image is not None:
+            with self._lock:
+                self.hits += 1
+            return image
+
+        with self._lock:
+            self.misses += 1
+        image = Image.open(image_path)
+        image.load()
+        if image.mode in PIXEL_CACHE_MODES:
+            self._write(raw_path, image)
+        return image
+
+    def _read(self, raw_path):
+        """通过内存映射读取缓存文件并复制出可写的图片，文件不存在或无效时返回None"""
+        try:
+            with open(raw_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, width, height, mode = PIXEL_CACHE_HEADER.unpack_from(mapped)
+            mode = mode.rstrip(b'\0').decode('ascii')
+            if magic != PIXEL_CACHE_MAGIC or mode not in PIXEL_CACHE_MODES:
+                return None
+            if len(mapped) != PIXEL_CACHE_HEADER.size + width * height * len(mode):
+                return None
+            pixels = memoryview(mapped)[PIXEL_CACHE_HEADER.size:]
+            try:
+                shared = Image.frombuffer(mode, (width, height), pixels, 'raw', mode, 0, 1)
+                # 映射的内存是只读的，复制一份完整的像素供绘制和编码使用
+                image = shared.copy()
+                del shared
+            finally:
+                pixels.release()
+            return image
+        except (struct.error, ValueError, BufferError):
+            return None
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+
+    def _write(self, raw_path, image):
+        """写入缓存文件（先写临时文件再改名，避免其它进程读到一半的数据）"""
+        header = PIXEL_CACHE_HEADER.pack(PIXEL_CACHE_MAGIC, image.width, image.height,
+                                         image.mode.encode('ascii'))
+        tmp_path = f"{raw_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(image.tobytes())
+            os.replace(tmp_path, raw_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        """缓存目录超过大小上限时，删除最久未修改的缓存文件"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.raw') and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板图片索引
+功能：
+1. 记录模板文件夹中每张图片的路径、修改时间、像素尺寸
+2. 记录从文件名（如 171-1300xcenter.jpeg）解析出的位置和字体大小，以及由此得出的可用文字区域
+3. 索引保存在模板文件夹中，文件变化时只重新读取变化的图片
+"""
+
+import os
+import json
+from PIL import Image
+from image_discovery import discover_images
+
+# 索引格式有变化时修改版本号，旧索引会被整体重建
+TEMPLATE_INDEX_VERSION = 1
+
+# 模板图片扩展名（不区分大小写）
+TEMPLATE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff')
+
+# 计算可用文字区域时与图片边缘保留的距离，与预定义位置的边距一致
+TEXT_AREA_MARGIN = 10
+
+
+def compute_text_area(image_size, position):
+    """
+    根据图片尺寸和文件名中的位置计算可用文字区域
+
+    返回 (left, top, width, height)；没有位置信息时为整张图片减去边距
+    """
+    width, height = image_size
+    margin = TEXT_AREA_MARGIN
+    left, top = margin, margin
+    if position:
+        x, y = position
+        if isinstance(x, int):
+            left = x
+        if isinstance(y, int):
+            top = y
+    area_width = max(width - left - margin, 0)
+    area_height = max(height - top - margin, 0)
+    return [left, top, area_width, area_height]
+
+
+class TemplateIndex:
+    INDEX_NAME = ".template_index.json"
+
+    def __init__(self, folder, parse_filename):
+        """
+        参数:
+        - folder: 模板图片文件夹
+        - parse_filename: 从文件名解析 (位置, 字体大小) 的函数
+        """
+        self.folder = folder
+        self.index_path = os.path.join(folder, self.INDEX_NAME)
+        self.parse_filename = parse_filename
+        self._entries = None
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == TEMPLATE_INDEX_VERSION:
+                return index.get('entries', {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save(self, entries):
+        """保存索引，模板文件夹只读时只保留在内存中"""
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': TEMPLATE_INDEX_VERSION, 'entries': entries},
+                          f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def _probe(self, path, name, stat):
+        """读取一张模板的信息（只解析图片头部，不解码像素）"""
+        with Image.open(path) as image:
+            image_size = image.size
+        position, font_size = self.parse_filename(name)
+        position = list(position) if position else None
+        return {
+            'name': name,
+            'mtime': stat.st_mtime_ns,
+            'bytes': stat.st_size,
+            'width': image_size[0],
+            'height': image_size[1],
+            'position': position,
+            'font_size': font_size,
+            'text_area': compute_text_area(image_size, position),
+        }
+
+    def refresh(self):
+        """
+        与文件夹内容同步，返回按文件名排序的条目列表
+
+        只有新增或修改过的图片才会被重新读取
+        """
+        old_entries = self._entries if self._entries is not None else self._load()
+        entries = {}
+        changed = False
+        # 一次目录遍历得到文件名和文件信息，排序在 entries() 中进行
+        for image in discover_images(self.folder, TEMPLATE_EXTENSIONS, with_stat=True, sort_key=None):
+            name, stat = image.name, image.stat
+            entry = old_entries.get(name)
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['bytes'] != stat.st_size:
+                try:
+                    entry = self._probe(image.path, name, stat)
+                except OSError:
+                    # 无法识别的图片文件，不放入索引
+                    continue
+                changed = True
+            entries[name] = entry
+
+        if changed or len(entries) != len(old_entries):
+            self._save(entries)
+        self._entries = entries
+        return self.entries()
+
+    def entries(self):
+        """按文件名排序的条目列表，每个条目附带完整路径"""
+        if self._entries is None:
+            return self.refresh()
+        return [dict(entry, path=os.path.join(self.folder, name))
+                for name, entry in sorted(self._entries.items())]
+
+    def layout_hints(self):
+        """{图片路径: (位置, 字体大小)}，用于跳过按文件名解析"""
+        hints = {}
+        for entry in self.entries():
+            position = tuple(entry['position']) if entry['position'] else None
+            hints[entry['path']] = (position, entry['font_size'])
+        return hints
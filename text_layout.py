@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文字排版
+功能：
+1. 按 (字体, 字号, 文字) 记住测量结果，排版和绘制时同一行文字只测量一次
+   基于字体度量（getmetrics、getlength）计算行高和行宽，中日韩文字按字缓存前进宽度，
+   不需要任何图片就能算出文字块尺寸
+2. 按可用宽度自动换行：中文、日文逐字断行，英文按单词断行，遵守常见的避头尾标点规则
+3. 文字块放不下时按二分查找缩小字号，在绘制之前就能知道是否超出可用区域
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+# 测量缓存的最大条目数
+DEFAULT_MEASURE_CACHE_SIZE = 65536
+
+# 自动缩小字号时的最小字号
+DEFAULT_MIN_FONT_SIZE = 12
+
+# 行与行之间的间距（像素）
+LINE_SPACING = 5
+
+# 每个字体缓存的非中日韩整行宽度的最大条目数
+MAX_LINE_ADVANCES = 4096
+
+# 不能出现在行首的标点（放在上一行末尾）
+NO_LINE_START = set("，。、；：？！…）》」』】〕〉”’%,.;:?!)]}")
+
+# 不能出现在行尾的标点（移到下一行开头）
+NO_LINE_END = set("（《「『【〔〈“‘([{")
+
+
+def is_cjk(char):
+    """中日韩文字和全角标点，可以在任意两个字之间断行"""
+    code = ord(char)
+    return (0x3000 <= code <= 0x30FF      # 中日标点、假名
+            or 0x3400 <= code <= 0x4DBF   # 扩展A
+            or 0x4E00 <= code <= 0x9FFF   # 基本汉字
+            or 0xF900 <= code <= 0xFAFF   # 兼容汉字
+            or 0xFF00 <= code <= 0xFFEF)  # 全角字符
+
+
+class FontMetrics:
+    """
+    一个字体（固定字号）的度量
+
+    ascent/descent 来自 getmetrics；行宽为前进宽度（getlength）。
+    纯中日韩文字的行宽由缓存的单字前进宽度相加得到（这类字之间没有字距调整），
+    其它文字整行调用 getlength 并缓存结果
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.ascent, self.descent = font.getmetrics()
+        self.line_height = self.ascent + self.descent
+        self._glyph_advances = {}
+        self._line_advances = {}
+
+    def advance(self, text):
+        """文字的前进宽度"""
+        glyph_advances = self._glyph_advances
+        total = 0.0
+        for char in text:
+            width = glyph_advances.get(char)
+            if width is None:
+                if not is_cjk(char):
+                    return self._line_advance(text)
+                width = glyph_advances[char] = self.font.getlength(char)
+            total += width
+        return total
+
+    def _line_advance(self, text):
+        width = self._line_advances.get(text)
+        if width is None:
+            if len(self._line_advances) >= MAX_LINE_ADVANCES:
+                self._line_advances.clear()
+            width = self._line_advances[text] = self.font.getlength(text)
+        return width
+
+
+class TextMeasurer:
+    """按 (字体, 字号, 文字) 缓存文字边界框的LRU缓存，线程安全"""
+
+    def __init__(self, max_entries=DEFAULT_MEASURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._boxes = OrderedDict()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def metrics(self, font, font_key):
+        """字体的度量对象（每个 font_key 只创建一次）"""
+        metrics = self._metrics.get(font_key)
+        if metrics is None:
+            metrics = FontMetrics(font)
+            with self._lock:
+                metrics = self._metrics.setdefault(font_key, metrics)
+        return metrics
+
+    def advance(self, font, font_key, text):
+        """文字的前进宽度（向上取整为像素）"""
+        return math.ceil(self.metrics(font, font_key).advance(text))
+
+    def bbox(self, font, font_key, text):
+        """
+        文字的边界框 (left, top, right, bottom)
+
+        font_key 用来区分字体，通常为 (字体路径, 字号)
+        """
+        key = (font_key, text)
+        with self._lock:
+            box = self._boxes.get(key)
+            if box is not None:
+                self._boxes.move_to_end(key)
+                self.hits += 1
+                return box
+            self.misses += 1
+
+        box = font.getbbox(text)
+        with self._lock:
+            self._boxes[key] = box
+            if len(self._boxes) > self.max_entries:
+                self._boxes.popitem(last=False)
+        return box
+
+    def width(self, font, font_key, text):
+        """文字的宽度"""
+        box = self.bbox(font, font_key, text)
+        return box[2] - box[0]
+
+    def clear(self):
+        with self._lock:
+            self._boxes.clear()
+            self._metrics.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._boxes),
+                'max_size': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def split_tokens(line):
+    """
+    把一行文字切分为不可再分的片段
+
+    中日韩文字每个字一个片段，连续的英文字母/数字为一个片段，空格单独成片段；
+    避头标点并入前一个片段，避尾标点并入后一个片段
+    """
+    tokens = []
+    word = ''
+    for char in line:
+        if char == ' ' or is_cjk(char) or char in NO_LINE_START or char in NO_LINE_END:
+            if word:
+                tokens.append(word)
+                word = ''
+            tokens.append(char)
+        else:
+            word += char
+    if word:
+        tokens.append(word)
+
+    merged = []
+    carry = ''
+    for token in tokens:
+        if token in NO_LINE_END:
+            carry += token
+            continue
+        token = carry + token
+        carry = ''
+        if token in NO_LINE_START and merged and merged[-1] != ' ':
+            merged[-1] += token
+        else:
+            merged.append(token)
+    if carry:
+        if merged:
+            merged[-1] += carry
+        else:
+            merged.append(carry)
+    return merged
+
+
+def wrap_line(line, max_width, width_of):
+    """按 max_width 把一行文字拆成多行，width_of(文字) 返回文字宽度"""
+    if not line.strip() or width_of(line) <= max_width:
+        return [line]
+
+    lines = []
+    current = ''
+    for token in split_tokens(line):
+        candidate = current + token
+        if width_of(candidate.rstrip()) <= max_width:
+            current = candidate
+            continue
+        if current.strip():
+            lines.append(current.rstrip())
+        current = '' if token == ' ' else token
+        # 单个片段（很长的英文单词）本身就放不下时逐字拆开
+        if width_of(current) > max_width:
+            pieces = ''
+            for char in current:
+                if pieces and width_of(pieces + char) > max_width:
+                    lines.append(pieces)
+                    pieces = ''
+                pieces += char
+            current = pieces
+    if current.strip():
+        lines.append(current.rstrip())
+    return lines
+
+
+def wrap_text(text, max_width, width_of):
+    """对多行文字逐行换行，保留原有的换行"""
+    lines = []
+    for line in text.split('\n'):
+        lines.extend(wrap_line(line, max_width, width_of))
+    return lines
+
+
+class TextLayout:
+    """排版结果：各行文字、字号、文字块尺寸和可用区域"""
+
+    def __init__(self, lines, font_size, width, height, max_width, max_height):
+        self.lines = lines
+        self.font_size = font_size
+        self.width = width
+        self.height = height
+        self.max_width = max_width
+        self.max_height = max_height
+
+    @property
+    def overflow(self):
+        """文字块超出可用区域"""
+        return self.width > self.max_width or self.height > self.max_height
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines)
+
+    def __repr__(self):
+        return (f"TextLayout(font_size={self.font_size}, size={self.width}x{self.height}, "
+                f"area={self.max_width}x{self.max_height}, lines={len(self.lines)}, "
+                f"overflow={self.overflow})")
+
+
+def layout_text(text, max_width, max_height, font_size, measure_at,
+                wrap=True, fit=False, min_font_size=DEFAULT_MIN_FONT_SIZE, line_gap=0):
+    """
+    排版文字
+
+    参数:
+    - text: 文字（可以包含换行）
+    - max_width, max_height: 可用区域大小
+    - font_size: 字号（fit=True 时为最大字号）
+    - measure_at: measure_at(字号) 返回 (width_of, 行高)，width_of(文字) 返回文字宽度
+    - wrap: 超出宽度时自动换行
+    - fit: 放不下时按二分查找缩小字号，最小到 min_font_size
+    - line_gap: 行高中包含的行间距，最后一行之后不计入文字块高度
+    """
+    def layout_at(size):
+        width_of, line_height = measure_at(size)
+        lines = wrap_text(text, max_width, width_of) if wrap else text.split('\n')
+        non_empty = [line for line in lines if line.strip()]
+        width = max((width_of(line) for line in non_empty), default=0)
+        height = max(len(non_empty) * line_height - line_gap, 0)
+        return TextLayout(lines, size, width, height, max_width, max_height)
+
+    layout = layout_at(font_size)
+    if not fit or not layout.overflow or font_size <= min_font_size:
+        return layout
+
+    # 二分查找能放下的最大字号
+    best = None
+    low, high = min_font_size, font_size - 1
+    while low <= high:
+        mid = (low + high) // 2
+        candidate = layout_at(mid)
+        if candidate.overflow:
+            high = mid - 1
+        else:
+            best = candidate
+            low = mid + 1
+    return best or layout_at(min_font_size)